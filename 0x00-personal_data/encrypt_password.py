@@ -2,31 +2,271 @@
 """
 Module for encrypting passwords.
 """
+import asyncio
 import bcrypt
-from typing import Union
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, List, Tuple, Union
 
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 10
+MAX_ROUNDS = 31
 
-def hash_password(password: str) -> bytes:
+_work_factor: int = None
+_work_factor_lock = threading.Lock()
+
+
+def calibrate_rounds(target_ms: float, min_rounds: int = MIN_ROUNDS,
+                     max_rounds: int = MAX_ROUNDS) -> int:
+    """
+    Finds the highest bcrypt cost whose hash time fits a latency budget.
+    Args:
+        target_ms: The budget for one hash, in milliseconds.
+        min_rounds: The cost returned even if it exceeds the budget.
+        max_rounds: The highest cost considered.
+    Returns:
+        int: The chosen bcrypt work factor.
+    """
+    password = b'calibration'
+    rounds = 4
+    elapsed_ms = 0.0
+    best = min_rounds
+    # each extra round doubles the cost: the rounds that fit sum to
+    # under twice the budget and the final, over-budget one can take
+    # about twice the budget alone, so calibrating takes up to about
+    # four times the budget
+    while rounds <= max_rounds:
+        start = time.perf_counter()
+        bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms > target_ms:
+            break
+        best = max(best, rounds)
+        rounds += 1
+    return best
+
+
+def work_factor() -> int:
+    """
+    Returns the bcrypt cost used for new hashes.
+
+    It is set by init_work_factor(), which runs at import when
+    BCRYPT_TARGET_MS is set, or else on first use.
+    """
+    if _work_factor is None:
+        return init_work_factor()
+    return _work_factor
+
+
+def init_work_factor() -> int:
+    """
+    Sets the bcrypt cost used for new hashes, once, and returns it.
+
+    When BCRYPT_TARGET_MS is set the cost is calibrated against it,
+    which takes up to about four times that budget; otherwise it is
+    BCRYPT_ROUNDS or DEFAULT_ROUNDS. Call it at startup so that no
+    request pays for the calibration; it runs at import already when
+    BCRYPT_TARGET_MS is set.
+    """
+    global _work_factor
+    with _work_factor_lock:
+        if _work_factor is None:
+            target_ms = os.getenv('BCRYPT_TARGET_MS')
+            if target_ms:
+                _work_factor = calibrate_rounds(float(target_ms))
+            else:
+                _work_factor = int(os.getenv('BCRYPT_ROUNDS',
+                                             DEFAULT_ROUNDS))
+    return _work_factor
+
+
+def set_work_factor(rounds: int):
+    """
+    Overrides the bcrypt cost used for new hashes.
+    """
+    global _work_factor
+    _work_factor = rounds
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """
+    Returns the cost a bcrypt hash ($2b$<cost>$...) was made with.
+    """
+    return int(hashed_password.split(b'$')[2])
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """
+    Tells whether a stored hash uses a lower cost than the current one.
+    """
+    return hash_rounds(hashed_password) < work_factor()
+
+
+def hash_password(password: str, rounds: int = None) -> bytes:
     """
     Hashes a password using bcrypt with a randomly generated salt.
     Args:
         password: The password to be hashed.
+        rounds: The bcrypt work factor, work_factor() by default.
     Returns:
         bytes: The salted, hashed password as a byte string.
     """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    if rounds is None:
+        rounds = work_factor()
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
 
 
-def is_valid(hashed_password: bytes, password: str) -> bool:
+def is_valid(hashed_password: bytes, password: str,
+             on_rehash: Callable[[bytes], None] = None) -> bool:
     """
     Checks if a password matches its hashed version.
     Args:
         hashed_password: The hashed password stored in the database.
         password: The password provided by the user to be checked.
+        on_rehash: Called with a fresh hash when the password matches
+            but the stored hash uses an outdated cost, so the caller
+            can store it.
     Returns:
         bool: True if the provided password matches the
         hashed password, False otherwise.
     """
-    return bcrypt.checkpw(
+    valid = bcrypt.checkpw(
         password.encode('utf-8'), hashed_password
     )
+    if valid and on_rehash is not None and needs_rehash(hashed_password):
+        on_rehash(hash_password(password))
+    return valid
+
+
+class HashingService:
+    """
+    Runs bcrypt hashing and checking on a bounded thread pool.
+
+    bcrypt releases the GIL while it works, so a thread pool spreads
+    hashes across cores. At most max_pending jobs may be queued or
+    running; submitting more blocks the caller until one finishes.
+    """
+
+    def __init__(self, max_workers: int = None,
+                 rounds: int = None, max_pending: int = None):
+        """
+        Args:
+            max_workers: Pool threads, one per CPU by default.
+            rounds: The bcrypt work factor used for new hashes,
+                work_factor() by default.
+            max_pending: Bound on queued plus running jobs,
+                four per worker by default.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.rounds = work_factor() if rounds is None else rounds
+        self._executor = ThreadPoolExecutor(self.max_workers,
+                                            thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(
+            max_pending or self.max_workers * 4
+        )
+
+    def submit_hash(self, password: str) -> Future:
+        """
+        Schedules hash_password(password) and returns its future.
+        """
+        return self._submit(hash_password, password, self.rounds)
+
+    def submit_verify(self, hashed_password: bytes, password: str) -> Future:
+        """
+        Schedules is_valid(hashed_password, password) and returns its future.
+        """
+        return self._submit(is_valid, hashed_password, password)
+
+    def hash_many(self, passwords: Iterable[str]) -> List[bytes]:
+        """
+        Hashes every password in parallel, preserving order.
+        """
+        futures = [self.submit_hash(password) for password in passwords]
+        return [future.result() for future in futures]
+
+    def verify_many(
+        self, pairs: Iterable[Tuple[bytes, str]]
+    ) -> List[bool]:
+        """
+        Checks every (hashed_password, password) pair in parallel,
+        preserving order.
+        """
+        futures = [self.submit_verify(hashed, password)
+                   for hashed, password in pairs]
+        return [future.result() for future in futures]
+
+    async def hash_async(self, password: str) -> bytes:
+        """
+        Awaitable hash_password running on the pool. Like submit_hash
+        it waits for a pending slot when the pool is saturated, without
+        blocking the event loop.
+        """
+        return await self._submit_async(hash_password, password,
+                                        self.rounds)
+
+    async def verify_async(self, hashed_password: bytes,
+                           password: str) -> bool:
+        """
+        Awaitable is_valid running on the pool.
+        """
+        return await self._submit_async(is_valid, hashed_password,
+                                        password)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the pool, waiting for running jobs by default.
+        """
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self) -> 'HashingService':
+        """
+        Returns the service for use in a with block.
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """
+        Shuts the pool down at the end of a with block.
+        """
+        self.shutdown()
+
+    def _submit(self, fn, *args) -> Future:
+        """
+        Submits fn once a pending slot is free.
+        """
+        self._slots.acquire()
+        return self._start(fn, *args)
+
+    async def _submit_async(self, fn, *args):
+        """
+        Runs fn on the pool once a pending slot is free. A saturated
+        pool is waited for on the loop's default executor, so the event
+        loop keeps running meanwhile.
+        """
+        if not self._slots.acquire(blocking=False):
+            loop = asyncio.get_running_loop()
+            acquired = loop.run_in_executor(None, self._slots.acquire)
+            try:
+                await asyncio.shield(acquired)
+            except asyncio.CancelledError:
+                acquired.add_done_callback(lambda _: self._slots.release())
+                raise
+        return await asyncio.wrap_future(self._start(fn, *args))
+
+    def _start(self, fn, *args) -> Future:
+        """
+        Submits fn on a pending slot already held by the caller.
+        """
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+if os.getenv('BCRYPT_TARGET_MS'):
+    init_work_factor()
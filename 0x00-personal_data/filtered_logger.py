@@ -2,22 +2,77 @@
 """
 Module for handling sensitive data securely
 """
-from typing import List
+from typing import Any, Callable, Dict, Iterator, List, TextIO, Tuple
 import re
+import argparse
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+import sys
+from contextlib import contextmanager
 from os import environ
 import mysql.connector
 
 
+class RedactionEngine:
+    """
+    Redacts a fixed set of fields in a single regex pass.
+
+    All fields are compiled once into one alternation pattern, so a
+    message is scanned exactly once no matter how many fields there are.
+    Engines are cached by (fields, redaction, separator); use
+    RedactionEngine.get to share them.
+    """
+    _cache: Dict[Tuple[Tuple[str, ...], str, str], 'RedactionEngine'] = {}
+
+    def __init__(self, fields: List[str], redaction: str, separator: str):
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        alternation = '|'.join(re.escape(field) for field in self.fields)
+        sep = re.escape(separator)
+        self.pattern = re.compile(f'({alternation})=.*?{sep}')
+        self.replacements = {
+            field: f'{field}={redaction}{separator}' for field in self.fields
+        }
+
+    @classmethod
+    def get(cls, fields: List[str], redaction: str,
+            separator: str) -> 'RedactionEngine':
+        """
+        Return the shared engine for this field set, building it once
+        """
+        key = (tuple(fields), redaction, separator)
+        engine = cls._cache.get(key)
+        if engine is None:
+            engine = cls._cache[key] = cls(fields, redaction, separator)
+        return engine
+
+    def redact(self, message: str) -> str:
+        """
+        Replace the value of every field in message with the redaction
+        """
+        if not self.fields:
+            return message
+        return self.pattern.sub(self._replace, message)
+
+    def _replace(self, match: re.Match) -> str:
+        """
+        Substitution callback: a dict hit is cheaper than re's template
+        expansion
+        """
+        return self.replacements[match[1]]
+
+
 def filter_datum(fields: List[str], redaction: str,
                  message: str, separator: str) -> str:
     """
     Replace sensitive data in the log message with redaction string
     """
-    for field in fields:
-        message = re.sub(f'{field}=.*?{separator}',
-                         f'{field}={redaction}{separator}', message)
-    return message
+    return RedactionEngine.get(fields, redaction, separator).redact(message)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -30,30 +85,179 @@ class RedactingFormatter(logging.Formatter):
 
     def __init__(self, fields: List[str]):
         super().__init__(self.FORMAT)
-        self.fields = fields
+        self.engine = RedactionEngine.get(fields, self.REDACTION,
+                                          self.SEPARATOR)
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        """
+        The fields redacted by this formatter
+        """
+        return self.engine.fields
 
     def format(self, record: logging.LogRecord) -> str:
         """
         Format the log record and redact sensitive fields
         """
-        record.msg = filter_datum(self.fields, self.REDACTION,
-                                  record.getMessage(), self.SEPARATOR)
+        record.msg = self.engine.redact(record.getMessage())
+        record.args = None
         return super().format(record)
 
 
-def get_logger() -> logging.Logger:
+class BoundedQueueHandler(logging.handlers.QueueHandler):
     """
-    Returns a Logger object named "user_data" with secure logging configuration
+    QueueHandler feeding a bounded queue.
+
+    Records are enqueued untouched so redaction and formatting happen on
+    the listener thread. When the queue is full the "block" policy waits
+    for room and the "drop" policy discards the record and counts it.
     """
-    logger = logging.getLogger("user_data")
+    POLICIES = ("block", "drop")
+
+    def __init__(self, log_queue: queue.Queue, policy: str = "block"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"policy must be one of {self.POLICIES}")
+        super().__init__(log_queue)
+        self.policy = policy
+        self.dropped = 0
+        self.listener = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Leave the record as is; the listener's formatter does the work
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """
+        Put the record on the queue according to the full-queue policy
+        """
+        if self.policy == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Current queue depth and number of records dropped so far
+        """
+        return {"queue_depth": self.queue.qsize(), "dropped": self.dropped}
+
+
+class BoundedQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener that can be stopped while its bounded queue is full
+    """
+    def enqueue_sentinel(self):
+        """
+        Block until there is room for the sentinel instead of raising
+        """
+        self.queue.put(self._sentinel)
+
+
+_LOGGER_SETUPS: Dict[str, Dict] = {}
+_LOGGERS_LOCK = threading.Lock()
+
+
+def get_logger(name: str = "user_data", fields: Tuple[str, ...] = None,
+               async_mode: bool = False, queue_size: int = 10000,
+               policy: str = "block") -> logging.Logger:
+    """
+    Returns a Logger object (named "user_data" by default) with secure
+    logging configuration
+
+    The logger is configured on the first call for a name and the same
+    instance is returned on every later call, so handlers never stack
+    up. logging.getLogger shares one logger per name, so asking for a
+    different config under a name already configured raises ValueError
+    instead of silently changing what the earlier callers redact.
+
+    With async_mode the logger only enqueues records; a background
+    listener thread redacts them and writes to stderr. queue_size bounds
+    the queue and policy ("block" or "drop") decides what happens when
+    it is full.
+    """
+    fields = tuple(PII_FIELDS if fields is None else fields)
+    config = (fields, async_mode, queue_size, policy)
+    setup = _LOGGER_SETUPS.get(name)
+    if setup is None:
+        with _LOGGERS_LOCK:
+            setup = _LOGGER_SETUPS.get(name)
+            if setup is None:
+                setup = _LOGGER_SETUPS[name] = _setup_logger(name, *config)
+    if setup["config"] != config:
+        raise ValueError(f"logger {name} is already configured with "
+                         f"{setup['config']}, not {config}")
+    return setup["logger"]
+
+
+def _setup_logger(name: str, fields: Tuple[str, ...], async_mode: bool,
+                  queue_size: int, policy: str) -> Dict:
+    """
+    Install the handlers of a get_logger config on the logger name
+    """
+    logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
     logger.propagate = False
 
+    formatter = RedactingFormatter(fields)
     stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(RedactingFormatter(PII_FIELDS))
-    logger.addHandler(stream_handler)
+    stream_handler.setFormatter(formatter)
+
+    queue_handler = None
+    if async_mode:
+        queue_handler = BoundedQueueHandler(queue.Queue(queue_size), policy)
+        queue_handler.listener = BoundedQueueListener(
+            queue_handler.queue, stream_handler, respect_handler_level=True)
+        queue_handler.listener.start()
+        atexit.register(queue_handler.listener.stop)
+        logger.addHandler(queue_handler)
+    else:
+        logger.addHandler(stream_handler)
+
+    return {"config": (fields, async_mode, queue_size, policy),
+            "logger": logger, "formatter": formatter,
+            "queue_handler": queue_handler}
+
 
-    return logger
+def add_sink(logger: logging.Logger, handler: logging.Handler):
+    """
+    Attach an extra sink (rotating file, memory buffer...) to a logger
+    returned by get_logger, redacting with the logger's fields.
+
+    Handlers without a formatter get the logger's RedactingFormatter, as
+    does the target of a buffering handler. Adding the same handler
+    twice is a no-op. In async mode the sink runs on the listener thread.
+    """
+    setup = _LOGGER_SETUPS.get(logger.name)
+    if setup is None:
+        raise ValueError(f"{logger.name} was not configured by get_logger")
+
+    with _LOGGERS_LOCK:
+        for sink in (handler, getattr(handler, "target", None)):
+            if sink is not None and sink.formatter is None:
+                sink.setFormatter(setup["formatter"])
+
+        queue_handler = setup["queue_handler"]
+        if queue_handler is None:
+            logger.addHandler(handler)
+        elif handler not in queue_handler.listener.handlers:
+            queue_handler.listener.handlers += (handler,)
+
+
+def get_logger_stats(logger: logging.Logger) -> Dict[str, int]:
+    """
+    Sum queue depth and dropped records over the logger's queue handlers
+    """
+    stats = {"queue_depth": 0, "dropped": 0}
+    for handler in logger.handlers:
+        if isinstance(handler, BoundedQueueHandler):
+            for key, value in handler.stats().items():
+                stats[key] += value
+    return stats
 
 
 def get_db() -> mysql.connector.connection.MySQLConnection:
@@ -72,11 +276,231 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return cnx
 
 
+class ConnectionPool:
+    """
+    Bounded pool of warm database connections
+
+    Connections are created lazily by connect (get_db by default) up to
+    size, health-checked when borrowed and replaced if dead. Borrowers
+    wait up to timeout seconds when every connection is in use; wait
+    times are recorded and exposed through stats().
+    """
+    def __init__(self, connect: Callable[[], Any] = None, size: int = 5,
+                 timeout: float = None):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.connect = get_db if connect is None else connect
+        self.size = size
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._borrows = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._replaced = 0
+
+    def acquire(self):
+        """
+        Borrow a healthy connection, opening or waiting for one if needed
+        """
+        start = time.perf_counter()
+        try:
+            cnx = self._idle.get_nowait()
+        except queue.Empty:
+            cnx = self._open_or_wait()
+
+        if not self._is_healthy(cnx):
+            self._discard(cnx)
+            try:
+                cnx = self.connect()
+            except Exception:
+                self._free_slot()
+                raise
+            with self._lock:
+                self._replaced += 1
+
+        wait = time.perf_counter() - start
+        with self._lock:
+            self._borrows += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        return cnx
+
+    def release(self, cnx):
+        """
+        Return a borrowed connection to the pool
+        """
+        with self._available:
+            self._idle.put(cnx)
+            self._available.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """
+        Borrow a connection for the duration of a with block
+        """
+        cnx = self.acquire()
+        try:
+            yield cnx
+        finally:
+            self.release(cnx)
+
+    def close(self):
+        """
+        Close every idle connection
+        """
+        while True:
+            try:
+                cnx = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(cnx)
+            self._free_slot()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Pool size, usage and borrow wait times in seconds
+        """
+        with self._lock:
+            borrows = self._borrows
+            return {
+                "size": self.size,
+                "created": self._created,
+                "idle": self._idle.qsize(),
+                "borrows": borrows,
+                "replaced": self._replaced,
+                "total_wait": self._total_wait,
+                "avg_wait": self._total_wait / borrows if borrows else 0.0,
+                "max_wait": self._max_wait,
+            }
+
+    def _open_or_wait(self):
+        """
+        Open a new connection if below size, otherwise wait until a
+        connection is released or a slot is freed
+        """
+        with self._available:
+            if not self._available.wait_for(
+                    lambda: (not self._idle.empty()
+                             or self._created < self.size), self.timeout):
+                raise TimeoutError("no database connection available")
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                self._created += 1
+        try:
+            return self.connect()
+        except Exception:
+            self._free_slot()
+            raise
+
+    def _free_slot(self):
+        """
+        Give back the slot of a connection that was closed or never
+        opened, waking one borrower waiting for it
+        """
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    @staticmethod
+    def _is_healthy(cnx) -> bool:
+        """
+        Ping the server; a connection that cannot answer is unhealthy
+        """
+        try:
+            return cnx.is_connected()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(cnx):
+        """
+        Close a connection, ignoring errors from an already dead one
+        """
+        try:
+            cnx.close()
+        except Exception:
+            pass
+
+
+_DB_POOL: ConnectionPool = None
+_DB_POOL_LOCK = threading.Lock()
+
+
+def get_db_pool() -> ConnectionPool:
+    """
+    Returns the process-wide pool of connections built by get_db
+
+    The pool size comes from PERSONAL_DATA_DB_POOL_SIZE (default 5).
+    """
+    global _DB_POOL
+    with _DB_POOL_LOCK:
+        if _DB_POOL is None:
+            size = int(environ.get("PERSONAL_DATA_DB_POOL_SIZE", 5))
+            _DB_POOL = ConnectionPool(get_db, size)
+    return _DB_POOL
+
+
+def export_users(db: mysql.connector.connection.MySQLConnection,
+                 sink: TextIO, batch_size: int = 1000,
+                 fields: Tuple[str, ...] = None) -> int:
+    """
+    Stream the users table into sink in constant memory
+
+    Rows are pulled from an unbuffered cursor batch_size at a time, each
+    batch is joined into one block and redacted in a single pass, then
+    written to sink with one write call. Returns the number of rows.
+    """
+    formatter = RedactingFormatter(PII_FIELDS if fields is None else fields)
+    cursor = db.cursor(buffered=False)
+    cursor.execute("SELECT * FROM users;")
+    field_names = [i[0] for i in cursor.description]
+    count = 0
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        block = formatter.engine.redact('\n'.join(
+            '; '.join(f'{f}={r}' for f, r in zip(field_names, row)) + ';'
+            for row in rows
+        ))
+        prefix = formatter.format(logging.LogRecord(
+            "user_data", logging.INFO, None, None, "", None, None))
+        sink.write(prefix + block.replace('\n', '\n' + prefix) + '\n')
+        count += len(rows)
+
+    cursor.close()
+    return count
+
+
 def main():
     """
     Retrieve and filter sensitive data from the database and log it securely
     """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--stream", action="store_true",
+                        help="export in batches instead of logging rows")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="rows fetched per batch in stream mode")
+    parser.add_argument("--output", default="-",
+                        help="file written in stream mode, - for stdout")
+    args = parser.parse_args()
+
+    if args.stream:
+        with get_db_pool().connection() as db:
+            if args.output == "-":
+                export_users(db, sys.stdout, args.batch_size)
+            else:
+                with open(args.output, "w", buffering=1 << 20) as sink:
+                    export_users(db, sink, args.batch_size)
+        return
+
     db = get_db()
+
     cursor = db.cursor()
     cursor.execute("SELECT * FROM users;")
     field_names = [i[0] for i in cursor.description]
@@ -15,6 +15,11 @@ app.register_blueprint(app_views)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 auth = None
 AUTH_TYPE = os.getenv("AUTH_TYPE")
+EXCLUDED_PATHS: List[str] = [
+    '/api/v1/status/',
+    '/api/v1/unauthorized/',
+    '/api/v1/forbidden/'
+]
 
 if AUTH_TYPE == "auth":
     from api.v1.auth.auth import Auth
@@ -33,13 +38,7 @@ def before_request() -> str:
     if auth is None:
         return
 
-    excluded_paths: List[str] = [
-        '/api/v1/status/',
-        '/api/v1/unauthorized/',
-        '/api/v1/forbidden/'
-    ]
-
-    if not auth.require_auth(request.path, excluded_paths):
+    if not auth.require_auth(request.path, EXCLUDED_PATHS):
         return
 
     if not auth.authorization_header(request):
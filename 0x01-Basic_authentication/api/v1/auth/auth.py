@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 """Auth class created"""
+from api.v1.auth.path_matcher import PathMatcher
 from flask import request
 from typing import List, TypeVar
 
@@ -8,24 +9,24 @@ class Auth:
     """Class to manage api authentications"""
 
     def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
-        """require auth paths"""
+        """require auth paths
+
+        excluded_paths is compiled into a PathMatcher once and reused for
+        as long as the same list object is passed in.
+        """
         if path is None or excluded_paths is None or excluded_paths == []:
             return True
 
-        if path in excluded_paths:
-            return False
-
-        slashless_exclude_paths: List[str] = []
-        asterik_exclude_paths: List[str] = []
-
-        for new_path in excluded_paths:
-            slashless_exclude_paths.append(new_path[:-1])
+        return not self._path_matcher(excluded_paths).match(path)
 
-        for new_path in slashless_exclude_paths:
-            if path.startswith(new_path):
-                return False
+    def _path_matcher(self, excluded_paths: List[str]) -> PathMatcher:
+        """compiled matcher of excluded_paths, cached on the instance"""
+        cached = getattr(self, '_excluded_paths_matcher', None)
+        if cached is None or cached[0] is not excluded_paths:
+            cached = (excluded_paths, PathMatcher(excluded_paths))
+            self._excluded_paths_matcher = cached
 
-        return True
+        return cached[1]
 
     def authorization_header(self, request=None) -> str:
         """Authorization header"""
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+""" Benchmark of User.save() cost with the file and journal storage engines
+
+Each engine runs in a child process inside a temporary directory, so
+the real .db_*.json files are left alone. The file engine rewrites the
+whole class on every save (O(n^2) overall), so it gets fewer users.
+
+Usage: ./benchmark_journal.py [--users N] [--file-users N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+CHILD = """
+import time
+from models.user import User
+User.load_from_file()
+start = time.perf_counter()
+for i in range({users}):
+    user = User()
+    user.email = "user{{}}@example.com".format(i)
+    user._password = "x" * 64
+    user.save()
+elapsed = time.perf_counter() - start
+print("{{:<8}} {{:>8}} users {{:8.3f}}s {{:10.2f}}us/save".format(
+    "{engine}", {users}, elapsed, elapsed / {users} * 1e6))
+"""
+
+
+def run(engine: str, users: int):
+    """ Time the creation of users users with one storage engine
+    """
+    env = dict(os.environ, MODELS_STORAGE=engine,
+               MODELS_JOURNAL_COMPACT_INTERVAL="0",
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run([sys.executable, "-c",
+                        CHILD.format(engine=engine, users=users)],
+                       cwd=tmp, env=env, check=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--file-users", type=int, default=2_000)
+    args = parser.parse_args()
+    run("file", args.file_users)
+    run("journal", args.users)
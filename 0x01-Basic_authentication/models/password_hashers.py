@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+""" Password hashers for models.user.User
+
+Every scheme except the legacy one writes a "<name>$..." string, so the
+scheme of a stored hash is known from its prefix and several schemes
+can coexist while users are migrated on their next login. Comparisons
+use hmac.compare_digest, which runs in constant time.
+
+The scheme for new hashes is chosen with USER_PASSWORD_HASHER:
+  - pbkdf2_sha256 (default): USER_PASSWORD_ITERATIONS rounds (100000)
+  - scrypt: cost USER_PASSWORD_SCRYPT_N (16384), r=8, p=1
+  - bcrypt: USER_PASSWORD_BCRYPT_ROUNDS (12), needs the bcrypt package
+  - sha256: the original unsalted hex digest, fast but unsafe
+"""
+from abc import ABC, abstractmethod
+from base64 import b64decode, b64encode
+from os import getenv
+from typing import Tuple
+import hashlib
+import hmac
+import os
+
+
+class PasswordHasher(ABC):
+    """ Interface of a password hashing scheme
+    """
+    name = None
+
+    @abstractmethod
+    def hash(self, pwd: str) -> str:
+        """ Hash a clear password
+        """
+
+    @abstractmethod
+    def verify(self, pwd: str, hashed: str) -> bool:
+        """ Check a clear password against a hash of this scheme
+        """
+
+    def needs_update(self, hashed: str) -> bool:
+        """ True if hashed was made with weaker settings than ours
+        """
+        return False
+
+
+class SHA256Hasher(PasswordHasher):
+    """ Unsalted SHA256 hex digest, the original User scheme
+    """
+    name = "sha256"
+
+    def hash(self, pwd: str) -> str:
+        """ Hex digest of the password
+        """
+        return hashlib.sha256(pwd.encode()).hexdigest().lower()
+
+    def verify(self, pwd: str, hashed: str) -> bool:
+        """ Constant-time comparison of hex digests
+        """
+        return hmac.compare_digest(self.hash(pwd), hashed.lower())
+
+
+class PBKDF2Hasher(PasswordHasher):
+    """ PBKDF2-HMAC-SHA256: pbkdf2_sha256$<iterations>$<salt>$<hash>
+    """
+    name = "pbkdf2_sha256"
+
+    def __init__(self, iterations: int = 100000):
+        """ Initialize with the iteration count of new hashes
+        """
+        self.iterations = iterations
+
+    def hash(self, pwd: str) -> str:
+        """ Salted PBKDF2 hash of the password
+        """
+        salt = os.urandom(16)
+        return "{}${}${}${}".format(
+            self.name, self.iterations, b64encode(salt).decode(),
+            b64encode(self._derive(pwd, salt, self.iterations)).decode())
+
+    def verify(self, pwd: str, hashed: str) -> bool:
+        """ Recompute with the stored salt and iterations
+        """
+        _, iterations, salt, digest = hashed.split("$")
+        computed = self._derive(pwd, b64decode(salt), int(iterations))
+        return hmac.compare_digest(computed, b64decode(digest))
+
+    def needs_update(self, hashed: str) -> bool:
+        """ Stored with fewer iterations than configured
+        """
+        return int(hashed.split("$")[1]) < self.iterations
+
+    @staticmethod
+    def _derive(pwd: str, salt: bytes, iterations: int) -> bytes:
+        """ Raw PBKDF2 output
+        """
+        return hashlib.pbkdf2_hmac("sha256", pwd.encode(), salt, iterations)
+
+
+class ScryptHasher(PasswordHasher):
+    """ scrypt: scrypt$<n>$<r>$<p>$<salt>$<hash>
+    """
+    name = "scrypt"
+
+    def __init__(self, n: int = 16384, r: int = 8, p: int = 1):
+        """ Initialize with the cost parameters of new hashes
+        """
+        self.n = n
+        self.r = r
+        self.p = p
+
+    def hash(self, pwd: str) -> str:
+        """ Salted scrypt hash of the password
+        """
+        salt = os.urandom(16)
+        digest = self._derive(pwd, salt, self.n, self.r, self.p)
+        return "{}${}${}${}${}${}".format(
+            self.name, self.n, self.r, self.p,
+            b64encode(salt).decode(), b64encode(digest).decode())
+
+    def verify(self, pwd: str, hashed: str) -> bool:
+        """ Recompute with the stored salt and cost parameters
+        """
+        _, n, r, p, salt, digest = hashed.split("$")
+        computed = self._derive(pwd, b64decode(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(computed, b64decode(digest))
+
+    def needs_update(self, hashed: str) -> bool:
+        """ Stored with a lower cost than configured
+        """
+        _, n, r, p = hashed.split("$")[:4]
+        return (int(n), int(r), int(p)) < (self.n, self.r, self.p)
+
+    @staticmethod
+    def _derive(pwd: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        """ Raw scrypt output
+        """
+        return hashlib.scrypt(pwd.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r + (1 << 20))
+
+
+class BcryptHasher(PasswordHasher):
+    """ bcrypt: bcrypt$<bcrypt hash>
+    """
+    name = "bcrypt"
+
+    def __init__(self, rounds: int = 12):
+        """ Initialize with the work factor of new hashes
+        """
+        import bcrypt
+        self.bcrypt = bcrypt
+        self.rounds = rounds
+
+    def hash(self, pwd: str) -> str:
+        """ bcrypt hash of the password
+        """
+        hashed = self.bcrypt.hashpw(pwd.encode(),
+                                    self.bcrypt.gensalt(self.rounds))
+        return "{}${}".format(self.name, hashed.decode())
+
+    def verify(self, pwd: str, hashed: str) -> bool:
+        """ bcrypt's own check
+        """
+        return self.bcrypt.checkpw(pwd.encode(),
+                                   hashed[len(self.name) + 1:].encode())
+
+    def needs_update(self, hashed: str) -> bool:
+        """ Stored with a lower work factor than configured
+        """
+        return int(hashed.split("$")[3]) < self.rounds
+
+
+_hashers = {}
+
+
+def get_hasher(name: str = None) -> PasswordHasher:
+    """ Return the hasher of a scheme, the configured one by default
+    """
+    if name is None:
+        name = getenv("USER_PASSWORD_HASHER", PBKDF2Hasher.name)
+    hasher = _hashers.get(name)
+    if hasher is not None:
+        return hasher
+
+    if name == SHA256Hasher.name:
+        hasher = SHA256Hasher()
+    elif name == PBKDF2Hasher.name:
+        hasher = PBKDF2Hasher(int(getenv("USER_PASSWORD_ITERATIONS",
+                                         100000)))
+    elif name == ScryptHasher.name:
+        hasher = ScryptHasher(int(getenv("USER_PASSWORD_SCRYPT_N", 16384)))
+    elif name == BcryptHasher.name:
+        hasher = BcryptHasher(int(getenv("USER_PASSWORD_BCRYPT_ROUNDS", 12)))
+    else:
+        raise ValueError("Unknown password hasher: {}".format(name))
+    _hashers[name] = hasher
+    return hasher
+
+
+def hash_password(pwd: str) -> str:
+    """ Hash a password with the configured scheme
+    """
+    return get_hasher().hash(pwd)
+
+
+def verify_password(pwd: str, hashed: str) -> Tuple[bool, bool]:
+    """ Check a password against a hash of any known scheme
+
+    Return (valid, needs_rehash): needs_rehash is True when the password
+    is valid but the hash is not what the configured scheme would make.
+    A hash whose scheme is unknown or cannot be used here (bcrypt
+    without the bcrypt package) never matches.
+    """
+    name, sep, _ = hashed.partition("$")
+    try:
+        hasher = get_hasher(name if sep else SHA256Hasher.name)
+        valid = hasher.verify(pwd, hashed)
+    except (ValueError, ImportError):
+        return False, False
+    if not valid:
+        return False, False
+    current = get_hasher()
+    return True, hasher is not current or current.needs_update(hashed)
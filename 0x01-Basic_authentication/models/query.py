@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+""" Query module: lazy, chainable queries over the objects of a model
+"""
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple, TypeVar
+from models.storage import compare, get_storage
+
+
+OPERATORS = ('eq', 'in', 'lt', 'lte', 'gt', 'gte', 'range', 'prefix')
+RANGE_OPERATORS = ('lt', 'lte', 'gt', 'gte', 'range')
+
+
+class SortedIndex():
+    """ Sorted index on one attribute, for ordering and range scans
+
+    values is kept sorted with bisect and ids[i] is the id of the object
+    whose value is values[i]. Objects whose value is None or does not
+    compare with the others are left out.
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index
+        """
+        self.attribute = attribute
+        self.values = []
+        self.ids = []
+        self.objects = {}
+        self.value_by_id = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index obj under its current attribute value
+        """
+        self.discard(obj.id)
+        value = getattr(obj, self.attribute, None)
+        if value is None:
+            return
+        try:
+            i = bisect_right(self.values, value)
+        except TypeError:
+            return
+        self.values.insert(i, value)
+        self.ids.insert(i, obj.id)
+        self.objects[obj.id] = obj
+        self.value_by_id[obj.id] = value
+
+    def discard(self, obj_id: str):
+        """ Drop obj_id from the index if present
+        """
+        if obj_id not in self.value_by_id:
+            return
+        value = self.value_by_id.pop(obj_id)
+        del self.objects[obj_id]
+        lo = bisect_left(self.values, value)
+        hi = bisect_right(self.values, value)
+        i = self.ids.index(obj_id, lo, hi)
+        del self.values[i]
+        del self.ids[i]
+
+    def scan(self, lower=None, lower_inclusive: bool = True, upper=None,
+             upper_inclusive: bool = True,
+             descending: bool = False) -> Iterator[TypeVar('Base')]:
+        """ Objects with lower <= value <= upper, in value order
+
+        A bound of None is open; the exclusive forms are chosen with
+        lower_inclusive and upper_inclusive. Like compare(), a bound that
+        does not compare with the values matches nothing.
+        """
+        start = 0
+        stop = len(self.values)
+        try:
+            if lower is not None:
+                if lower_inclusive:
+                    start = bisect_left(self.values, lower)
+                else:
+                    start = bisect_right(self.values, lower)
+            if upper is not None:
+                if upper_inclusive:
+                    stop = bisect_right(self.values, upper)
+                else:
+                    stop = bisect_left(self.values, upper)
+        except TypeError:
+            return
+        ids = self.ids[start:stop]
+        if descending:
+            ids.reverse()
+        for obj_id in ids:
+            obj = self.objects.get(obj_id)
+            if obj is not None:
+                yield obj
+
+
+class Query():
+    """ Query over the objects of a Base subclass
+
+    Built by chaining: every method returns a new Query, e.g.
+    User.query().filter(created_at__gte=t).order_by("-created_at")
+    .limit(50). Iterating it yields the objects lazily, so first() or a
+    limit stop as soon as enough objects matched.
+
+    filter() conditions are attribute=value for equality, or
+    attribute__<op>=value with op one of in, lt, lte, gt, gte, range
+    (an inclusive (low, high) pair) and prefix (str.startswith). Values
+    are taken as the attribute holds them, so a TIMESTAMP_FORMAT string
+    compared with a timestamp attribute is parsed first.
+
+    An eq or in condition on one of the model's INDEXED_ATTRIBUTES
+    takes its candidates from the hash index. Otherwise, ordering by or
+    a range on one of SORTED_ATTRIBUTES walks the sorted index between
+    the bounds. Anything else scans all objects. Like search(), indexes
+    hold the values of each object's last save, and every candidate is
+    checked against all conditions.
+
+    With a lazy storage engine the whole query, limit and offset
+    included, is handed to the storage instead.
+    """
+
+    def __init__(self, model: type):
+        """ Query matching every object of model
+        """
+        self.model = model
+        self.conditions: List[Tuple[str, str, object]] = []
+        self.ordering = None
+        self.descending = False
+        self.start = 0
+        self.count_limit = None
+
+    def _copy(self) -> 'Query':
+        """ A new Query with the same settings
+        """
+        query = Query(self.model)
+        query.conditions = list(self.conditions)
+        query.ordering = self.ordering
+        query.descending = self.descending
+        query.start = self.start
+        query.count_limit = self.count_limit
+        return query
+
+    def where(self, attribute: str, op: str, value) -> 'Query':
+        """ Add the condition "attribute op value"
+        """
+        if op not in OPERATORS:
+            raise ValueError("Unknown query operator: {}".format(op))
+        convert = self.model.attribute_value
+        if op == 'range':
+            low, high = value
+            value = (convert(attribute, low), convert(attribute, high))
+        elif op == 'in':
+            value = tuple(convert(attribute, item) for item in value)
+        elif op != 'prefix':
+            value = convert(attribute, value)
+        query = self._copy()
+        query.conditions.append((attribute, op, value))
+        return query
+
+    def filter(self, **conditions: dict) -> 'Query':
+        """ Add conditions written as attribute[__op]=value
+        """
+        query = self
+        for key, value in conditions.items():
+            attribute, sep, op = key.rpartition('__')
+            if not sep or op not in OPERATORS:
+                attribute, op = key, 'eq'
+            query = query.where(attribute, op, value)
+        return query
+
+    def order_by(self, attribute: str) -> 'Query':
+        """ Order by attribute, descending if it starts with "-"
+        """
+        query = self._copy()
+        query.descending = attribute.startswith('-')
+        query.ordering = attribute.lstrip('-')
+        return query
+
+    def offset(self, count: int) -> 'Query':
+        """ Skip the first count results
+        """
+        query = self._copy()
+        query.start = count
+        return query
+
+    def limit(self, count: int) -> 'Query':
+        """ Yield at most count results
+        """
+        query = self._copy()
+        query.count_limit = count
+        return query
+
+    def first(self) -> TypeVar('Base'):
+        """ The first result, or None
+        """
+        return next(iter(self.limit(1)), None)
+
+    def all(self) -> List[TypeVar('Base')]:
+        """ All the results as a list
+        """
+        return list(self)
+
+    def count(self) -> int:
+        """ Number of results
+        """
+        storage = get_storage()
+        if storage.lazy and self.start == 0 and self.count_limit is None:
+            return storage.count(self.model.__name__,
+                                 self._json_conditions())
+        return sum(1 for _ in self)
+
+    def __iter__(self) -> Iterator[TypeVar('Base')]:
+        """ Lazily yield the matching objects
+        """
+        storage = get_storage()
+        if storage.lazy:
+            rows = storage.select(self.model.__name__,
+                                  self._json_conditions(), self.ordering,
+                                  self.descending, self.count_limit,
+                                  self.start)
+            return map(self.model.materialize, rows)
+
+        candidates, ordered = self._candidates()
+        objs = filter(self._matches, candidates)
+        if self.ordering is not None and not ordered:
+            objs = iter(sorted(objs, key=self._sort_key,
+                               reverse=self.descending))
+        stop = None
+        if self.count_limit is not None:
+            stop = self.start + self.count_limit
+        return islice(objs, self.start, stop)
+
+    def _json_conditions(self) -> List[Tuple[str, str, object]]:
+        """ The conditions with their values as stored in JSON
+        """
+        json_value = self.model.json_value
+        conditions = []
+        for attribute, op, value in self.conditions:
+            if op in ('in', 'range'):
+                value = tuple(json_value(item) for item in value)
+            else:
+                value = json_value(value)
+            conditions.append((attribute, op, value))
+        return conditions
+
+    def _candidates(self) -> Tuple[Iterable[TypeVar('Base')], bool]:
+        """ Objects to check, and whether they come in the right order
+        """
+        for attribute, op, value in self.conditions:
+            if attribute not in self.model.INDEXED_ATTRIBUTES or \
+                    op not in ('eq', 'in'):
+                continue
+            index = self.model.index(attribute)
+            try:
+                if op == 'eq':
+                    return index.lookup(value), False
+                found = {}
+                for item in value:
+                    for obj in index.lookup(item):
+                        found[obj.id] = obj
+                return list(found.values()), False
+            except TypeError:
+                continue
+
+        sorted_attributes = self.model.SORTED_ATTRIBUTES
+        if self.ordering in sorted_attributes:
+            return self._scan(self.ordering, self.descending), True
+        for attribute, op, value in self.conditions:
+            if attribute in sorted_attributes and op in RANGE_OPERATORS:
+                return self._scan(attribute, False), \
+                    self.ordering is None
+
+        return self.model.objects(), False
+
+    def _scan(self, attribute: str,
+              descending: bool) -> Iterator[TypeVar('Base')]:
+        """ Walk the sorted index of attribute within the range conditions
+
+        The bounds are taken inclusive: _matches drops the objects
+        equal to an exclusive bound. Bounds that do not compare with
+        each other cannot all compare with the values, so nothing
+        matches.
+        """
+        lower = upper = None
+        for name, op, value in self.conditions:
+            if name != attribute or op not in RANGE_OPERATORS + ('eq',):
+                continue
+            low = high = value
+            if op == 'range':
+                low, high = value
+            try:
+                if op in ('gt', 'gte', 'range', 'eq'):
+                    if lower is None or low > lower:
+                        lower = low
+                if op in ('lt', 'lte', 'range', 'eq'):
+                    if upper is None or high < upper:
+                        upper = high
+            except TypeError:
+                return iter(())
+        index = self.model.sorted_index(attribute)
+        return index.scan(lower, True, upper, True, descending)
+
+    def _matches(self, obj: TypeVar('Base')) -> bool:
+        """ True if obj meets every condition
+        """
+        for attribute, op, value in self.conditions:
+            if not compare(getattr(obj, attribute), op, value):
+                return False
+        return True
+
+    def _sort_key(self, obj: TypeVar('Base')) -> tuple:
+        """ Sort key ranking objects without a value after the others
+        """
+        value = getattr(obj, self.ordering, None)
+        return (value is None, value)
@@ -0,0 +1,1238 @@
+#!/usr/bin/env python3
+""" Storage engines persisting the objects of models.base
+
+An engine works on plain JSON dictionaries keyed by object id and never
+sees model instances, so it does not depend on models.base:
+  - load(s_class) returns {id: json} for a class
+  - load_shards(s_class) yields the same as (shards read, shard count,
+    {id: json} of one shard) as each shard is read
+  - dump(s_class, objs_json) writes a full snapshot
+  - upsert(s_class, obj_id, obj_json, snapshot) persists one object
+  - delete(s_class, obj_id, snapshot) persists one removal
+  - flush(s_class=None) writes anything still buffered
+  - stamp(s_class) identifies the on-disk state of a class
+  - changes(s_class, stamp) returns (new stamp, entries) where entries
+    are the journal-style {"op", "id", "obj"} changes made since stamp,
+    [] when nothing changed, or None when a full load() is needed
+snapshot is a callable returning the current {id: json} of the class,
+for engines that need the whole class to persist a single change.
+dump, upsert and delete return the stamps of the class just before and
+just after the write, taken under the engine's locks, so a caller whose
+last known stamp is the first can take the second without reloading;
+they return None when the write is deferred.
+
+Engines whose lazy attribute is True keep the objects on disk instead
+of having them all loaded, and also answer:
+  - ensure_indexes(s_class, attributes) indexes attributes
+  - get(s_class, obj_id) returns the json of one object or None
+  - select(s_class, conditions, ordering, descending, limit, offset)
+    iterates over the json of the matching objects
+  - count(s_class, conditions=()) counts them
+where conditions are models.query (attribute, op, value) triples with
+JSON values.
+
+The engine is chosen with the MODELS_STORAGE environment variable.
+"""
+from os import getenv, path
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional,
+                    Tuple)
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from itertools import islice
+import atexit
+import fcntl
+import glob
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import stat
+import struct
+import tempfile
+import threading
+import time
+
+
+Snapshot = Callable[[], Dict[str, dict]]
+
+# os.umask can only be read by setting it, so read it once at import
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+def compare(current, op: str, value) -> bool:
+    """ Whether the query condition "current op value" holds
+
+    Values that do not compare (None against a str...) never match.
+    """
+    try:
+        if op == 'eq':
+            return current == value
+        if op == 'in':
+            return current in value
+        if op == 'lt':
+            return current < value
+        if op == 'lte':
+            return current <= value
+        if op == 'gt':
+            return current > value
+        if op == 'gte':
+            return current >= value
+        if op == 'range':
+            return value[0] <= current <= value[1]
+        if op == 'prefix':
+            return type(current) is str and current.startswith(value)
+    except TypeError:
+        return False
+    raise ValueError("Unknown query operator: {}".format(op))
+
+
+def file_mode(file_path: str) -> int:
+    """ Permissions for a file replacing file_path
+
+    Those of file_path if it exists, else those open() would give a new
+    file. tempfile.mkstemp creates files readable by their owner only.
+    """
+    try:
+        return stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~UMASK
+
+
+class FileStorage():
+    """ One JSON file per class, .db_<Class>.json, rewritten on every change
+
+    Snapshots are written to a temporary file, fsynced and moved over
+    the old one with os.replace, under a lock, so a crash never leaves a
+    truncated file and concurrent writers cannot interleave.
+
+    With write_delay > 0, changes are written behind: the first change
+    schedules one snapshot write write_delay seconds later and any
+    change made before then is folded into it. flush() writes pending
+    snapshots immediately; it also runs at exit.
+    """
+    lazy = False
+
+    def __init__(self, write_delay: float = 0):
+        """ Initialize the engine
+        """
+        self.write_delay = write_delay
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._timers = {}
+        atexit.register(self.flush)
+
+    def file_path(self, s_class: str) -> str:
+        """ Path of the snapshot file of a class
+        """
+        return ".db_{}.json".format(s_class)
+
+    def load(self, s_class: str) -> Dict[str, dict]:
+        """ Read the snapshot of a class, writing pending changes first
+        """
+        if s_class in self._pending:
+            self.flush(s_class)
+        file_path = self.file_path(s_class)
+        if not path.exists(file_path):
+            return {}
+        with open(file_path, 'r') as f:
+            return json.load(f)
+
+    def dump(self, s_class: str, objs_json: Dict[str, dict]):
+        """ Atomically replace the snapshot of a class
+        """
+        with self._lock:
+            before = self.stamp(s_class)
+            self._pending.pop(s_class, None)
+            self._dump_file(self.file_path(s_class), objs_json)
+            return before, self.stamp(s_class)
+
+    def load_shards(self, s_class: str) -> Iterator[Tuple[int, int, dict]]:
+        """ The whole class as a single shard
+        """
+        yield 1, 1, self.load(s_class)
+
+    def stamp(self, s_class: str) -> tuple:
+        """ Inode, mtime and size of the snapshot file
+        """
+        return (self._file_stamp(self.file_path(s_class)),)
+
+    def changes(self, s_class: str, since: tuple) -> Tuple[tuple, list]:
+        """ A snapshot can only be reloaded whole once it has changed
+        """
+        stamp = self.stamp(s_class)
+        return stamp, ([] if stamp == since else None)
+
+    def upsert(self, s_class: str, obj_id: str, obj_json: dict,
+               snapshot: Snapshot):
+        """ Persist one saved object by rewriting the snapshot
+        """
+        return self._write(s_class, snapshot)
+
+    def delete(self, s_class: str, obj_id: str, snapshot: Snapshot):
+        """ Persist one removal by rewriting the snapshot
+        """
+        return self._write(s_class, snapshot)
+
+    def flush(self, s_class: str = None):
+        """ Write the pending snapshot of s_class, or of every class
+        """
+        with self._lock:
+            s_classes = list(self._pending) if s_class is None \
+                else [s_class]
+            for name in s_classes:
+                # a change made from now on needs a new timer
+                self._timers.pop(name, None)
+                snapshot = self._pending.get(name)
+                if snapshot is not None:
+                    self.dump(name, snapshot())
+
+    def ensure_indexes(self, s_class: str, attributes: Tuple[str, ...]):
+        """ Nothing to do, the objects are indexed in memory
+        """
+
+    @staticmethod
+    def _dump_file(file_path: str, objs_json: Dict[str, dict]):
+        """ Write objs_json to a temporary file, fsync it and move it over
+        file_path
+        """
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=path.basename(file_path) + ".",
+            dir=path.dirname(file_path) or ".")
+        try:
+            os.fchmod(fd, file_mode(file_path))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(objs_json, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _file_stamp(file_path: str) -> Optional[tuple]:
+        """ (inode, mtime, size) of a file, None if it does not exist
+        """
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _write(self, s_class: str, snapshot: Snapshot):
+        """ Rewrite the snapshot now, or schedule it when writing behind
+        """
+        if self.write_delay <= 0:
+            with self._lock:
+                return self.dump(s_class, snapshot())
+        with self._lock:
+            self._pending[s_class] = snapshot
+            if s_class in self._timers:
+                return None
+            timer = threading.Timer(self.write_delay, self.flush,
+                                    args=(s_class,))
+            timer.daemon = True
+            self._timers[s_class] = timer
+            timer.start()
+        return None
+
+
+class JournalStorage(FileStorage):
+    """ Snapshot file plus an append-only journal, .db_<Class>.journal
+
+    Each upsert or delete appends one JSON line to the journal, so a
+    change costs O(1) whatever the size of the class. A background
+    thread compacts the journal into the snapshot every
+    compact_interval seconds; dump() compacts immediately. load()
+    replays the journal over the snapshot, skipping a line torn by a
+    writer that crashed.
+
+    Every process appending to, reading or compacting the journal of a
+    class holds an exclusive flock on .db_<Class>.lock meanwhile, so a
+    compaction never truncates lines another process wrote after it
+    read the journal, and a reader never sees a half-compacted class.
+    """
+
+    def __init__(self, compact_interval: float = 60):
+        """ Initialize the engine and start the compaction thread
+        """
+        super().__init__()
+        self.compact_interval = compact_interval
+        self._journals = {}
+        self._snapshots = {}
+        self._lock_files = {}
+        self._lock_depths = {}
+        self._compactor = None
+        if compact_interval > 0:
+            self._compactor = threading.Thread(target=self._compact_loop,
+                                               daemon=True)
+            self._compactor.start()
+
+    def journal_path(self, s_class: str) -> str:
+        """ Path of the journal file of a class
+        """
+        return ".db_{}.journal".format(s_class)
+
+    def lock_path(self, s_class: str) -> str:
+        """ Path of the file locked around journal accesses of a class
+        """
+        return ".db_{}.lock".format(s_class)
+
+    def load(self, s_class: str) -> Dict[str, dict]:
+        """ Read the snapshot then replay the journal over it
+        """
+        with self._file_lock(s_class):
+            objs_json = super().load(s_class)
+            journal_path = self.journal_path(s_class)
+            if not path.exists(journal_path):
+                return objs_json
+            with open(journal_path, 'rb') as f:
+                entries = journal_entries(f.read())
+            for entry in entries:
+                if entry["op"] == "upsert":
+                    objs_json[entry["id"]] = entry["obj"]
+                else:
+                    objs_json.pop(entry["id"], None)
+            return objs_json
+
+    def stamp(self, s_class: str) -> tuple:
+        """ Snapshot stamp, journal inode and journal size
+        """
+        journal = self._file_stamp(self.journal_path(s_class))
+        if journal is None:
+            return (self._file_stamp(self.file_path(s_class)), None, 0)
+        return (self._file_stamp(self.file_path(s_class)),
+                journal[0], journal[2])
+
+    def changes(self, s_class: str, since: tuple) -> Tuple[tuple, list]:
+        """ Follow the journal when only new lines were appended to it
+        """
+        stamp = self.stamp(s_class)
+        if stamp == since:
+            return stamp, []
+        with self._file_lock(s_class):
+            stamp = self.stamp(s_class)
+            if since is None or stamp[:2] != since[:2] or \
+                    stamp[2] < since[2]:
+                return stamp, None
+            with open(self.journal_path(s_class), 'rb') as f:
+                f.seek(since[2])
+                data = f.read(stamp[2] - since[2])
+        # stop at the last complete line; the rest is read next time
+        data = data[:data.rfind(b"\n") + 1]
+        return (stamp[0], stamp[1], since[2] + len(data)), \
+            journal_entries(data)
+
+    def dump(self, s_class: str, objs_json: Dict[str, dict]):
+        """ Write the snapshot and empty the journal
+        """
+        with self._file_lock(s_class):
+            before = self.stamp(s_class)
+            super().dump(s_class, objs_json)
+            self._truncate_journal(s_class)
+            return before, self.stamp(s_class)
+
+    def upsert(self, s_class: str, obj_id: str, obj_json: dict,
+               snapshot: Snapshot):
+        """ Append an upsert line to the journal
+        """
+        return self._append(s_class, {"op": "upsert", "id": obj_id,
+                                      "obj": obj_json}, snapshot)
+
+    def delete(self, s_class: str, obj_id: str, snapshot: Snapshot):
+        """ Append a delete line to the journal
+        """
+        return self._append(s_class, {"op": "delete", "id": obj_id}, snapshot)
+
+    def compact(self, s_class: str):
+        """ Fold the journal of a class into its snapshot
+
+        The snapshot is rebuilt from the files, not from this process's
+        objects, and the class stays locked from reading the journal to
+        emptying it, so lines other processes appended are kept.
+        """
+        with self._lock:
+            if s_class in self._snapshots:
+                with self._file_lock(s_class):
+                    self.dump(s_class, self.load(s_class))
+
+    def compact_all(self):
+        """ Compact every class written since its last compaction
+        """
+        with self._lock:
+            for s_class in list(self._snapshots):
+                self.compact(s_class)
+
+    def flush(self, s_class: str = None):
+        """ Journal lines are written immediately; flushing compacts
+        """
+        if s_class is None:
+            self.compact_all()
+        else:
+            self.compact(s_class)
+
+    def _append(self, s_class: str, entry: dict,
+                snapshot: Snapshot) -> Tuple[tuple, tuple]:
+        """ Write one journal line and mark the class for compaction
+        """
+        line = json.dumps(entry) + "\n"
+        with self._file_lock(s_class):
+            before = self.stamp(s_class)
+            journal = self._journals.get(s_class)
+            if journal is None:
+                journal = open(self.journal_path(s_class), 'a+')
+                self._journals[s_class] = journal
+            size = os.fstat(journal.fileno()).st_size
+            if size and os.pread(journal.fileno(), 1, size - 1) != b"\n":
+                # end the line torn by a crashed writer instead of
+                # gluing this one onto it
+                line = "\n" + line
+            journal.write(line)
+            journal.flush()
+            self._snapshots[s_class] = snapshot
+            return before, self.stamp(s_class)
+
+    @contextmanager
+    def _file_lock(self, s_class: str) -> Iterator[None]:
+        """ Hold self._lock and the flock of a class
+
+        Re-entrant: only the outermost holder in this process takes and
+        releases the flock.
+        """
+        with self._lock:
+            lock_file = self._lock_files.get(s_class)
+            if lock_file is None:
+                lock_file = open(self.lock_path(s_class), 'a')
+                self._lock_files[s_class] = lock_file
+            depth = self._lock_depths.get(s_class, 0)
+            if depth == 0:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._lock_depths[s_class] = depth + 1
+            try:
+                yield
+            finally:
+                self._lock_depths[s_class] = depth
+                if depth == 0:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _truncate_journal(self, s_class: str):
+        """ Empty the journal of a class once folded into the snapshot
+        """
+        journal = self._journals.pop(s_class, None)
+        if journal is not None:
+            journal.close()
+        open(self.journal_path(s_class), 'w').close()
+        self._snapshots.pop(s_class, None)
+
+    def _compact_loop(self):
+        """ Body of the background compaction thread
+        """
+        while True:
+            time.sleep(self.compact_interval)
+            self.compact_all()
+
+
+def journal_entries(data: bytes) -> List[dict]:
+    """ Entries of the complete journal lines in data
+
+    An incomplete last line is left for the next read; a line torn by a
+    writer that crashed, and ended by the next writer, is skipped.
+    """
+    entries = []
+    for line in data[:data.rfind(b"\n") + 1].splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+
+SNAPSHOT_MAGIC = b"MDLSNAP1"
+SNAPSHOT_HEADER = struct.Struct("<8sQQQ")
+SNAPSHOT_RECORD = struct.Struct("<IH")
+SNAPSHOT_INDEX = struct.Struct("<QQ")
+SNAPSHOT_TABLE = struct.Struct("<HQ")
+
+
+def id_hash(obj_id: bytes) -> int:
+    """ 64-bit hash of an id, the same in every process
+    """
+    return int.from_bytes(hashlib.blake2b(obj_id, digest_size=8).digest(),
+                          "little")
+
+
+def value_hash(value) -> int:
+    """ 64-bit hash of a JSON value, the same in every process
+    """
+    return id_hash(json.dumps(value).encode())
+
+
+def write_snapshot(file_path: str, records: Iterable[Tuple[bytes, bytes]],
+                   attributes: Tuple[str, ...] = ()):
+    """ Atomically write (id, json) byte pairs as a binary snapshot
+
+    Layout, little-endian:
+      - header: magic, record count (u64), offset of the id index (u64),
+        offset of the attribute directory (u64)
+      - records: json length (u32), id length (u16), id, json
+      - id index: (id_hash(id) (u64), record offset (u64)) sorted
+      - one table per attribute, like the id index but hashing the
+        value of the attribute with value_hash
+      - attribute directory: number of tables (u16), then for each the
+        name length (u16), the table offset (u64) and the name
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=path.basename(file_path) + ".",
+                                    dir=path.dirname(file_path) or ".")
+    try:
+        os.fchmod(fd, file_mode(file_path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 0, 0, 0))
+            entries = []
+            tables = {attribute: [] for attribute in attributes}
+            offset = SNAPSHOT_HEADER.size
+            for obj_id, obj_json in records:
+                entries.append((id_hash(obj_id), offset))
+                if tables:
+                    obj = json.loads(obj_json)
+                    for attribute, table in tables.items():
+                        table.append((value_hash(obj.get(attribute)),
+                                      offset))
+                f.write(SNAPSHOT_RECORD.pack(len(obj_json), len(obj_id)))
+                f.write(obj_id)
+                f.write(obj_json)
+                offset += SNAPSHOT_RECORD.size + len(obj_id) + len(obj_json)
+            index_offset = offset
+            directory = []
+            for name, table in [(None, entries)] + list(tables.items()):
+                table.sort()
+                if name is not None:
+                    directory.append((name.encode(), offset))
+                for entry in table:
+                    f.write(SNAPSHOT_INDEX.pack(*entry))
+                offset += len(table) * SNAPSHOT_INDEX.size
+            f.write(struct.pack("<H", len(directory)))
+            for name, table_offset in directory:
+                f.write(SNAPSHOT_TABLE.pack(len(name), table_offset))
+                f.write(name)
+            f.seek(0)
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(entries),
+                                         index_offset, offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class BinarySnapshot():
+    """ Read-only, memory-mapped view of a file made by write_snapshot
+
+    Opening it reads the header and the attribute directory only;
+    find() and lookup() binary search a sorted table and decode nothing
+    but the records they return. The pages live in the page cache,
+    shared by every process mapping the same file.
+    """
+
+    def __init__(self, file_path: str):
+        """ Map the file and read its header and attribute directory
+        """
+        with open(file_path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.index_offset, offset = \
+            SNAPSHOT_HEADER.unpack_from(self.map, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Not a binary snapshot: {}".format(file_path))
+        self.tables = {}
+        offset += 2
+        for _ in range(struct.unpack_from("<H", self.map, offset - 2)[0]):
+            length, table_offset = SNAPSHOT_TABLE.unpack_from(self.map,
+                                                              offset)
+            offset += SNAPSHOT_TABLE.size
+            name = self.map[offset:offset + length].decode()
+            self.tables[name] = table_offset
+            offset += length
+
+    def record(self, offset: int) -> Tuple[bytes, bytes, int]:
+        """ id and json of the record at offset, and the next offset
+        """
+        json_length, id_length = SNAPSHOT_RECORD.unpack_from(self.map,
+                                                             offset)
+        start = offset + SNAPSHOT_RECORD.size
+        end = start + id_length + json_length
+        return self.map[start:start + id_length], \
+            self.map[start + id_length:end], end
+
+    def find(self, obj_id: bytes) -> Optional[bytes]:
+        """ json of the record of obj_id, None if there is none
+        """
+        for offset in self._offsets(self.index_offset, id_hash(obj_id)):
+            record_id, record_json, _ = self.record(offset)
+            if record_id == obj_id:
+                return record_json
+        return None
+
+    def lookup(self, attribute: str,
+               values: Iterable) -> Iterator[Tuple[bytes, bytes]]:
+        """ (id, json) of the records whose attribute may be in values
+
+        Hash collisions are returned too: the caller checks the values.
+        """
+        seen = set()
+        for value in values:
+            target = value_hash(value)
+            for offset in self._offsets(self.tables[attribute], target):
+                if offset not in seen:
+                    seen.add(offset)
+                    yield self.record(offset)[:2]
+
+    def records(self) -> Iterator[Tuple[bytes, bytes]]:
+        """ (id, json) of every record, in file order
+        """
+        offset = SNAPSHOT_HEADER.size
+        while offset < self.index_offset:
+            obj_id, obj_json, offset = self.record(offset)
+            yield obj_id, obj_json
+
+    def _offsets(self, table_offset: int, target: int) -> Iterator[int]:
+        """ Record offsets of the table entries hashed to target
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(table_offset, mid)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self.count:
+            entry_hash, offset = self._entry(table_offset, lo)
+            if entry_hash != target:
+                break
+            yield offset
+            lo += 1
+
+    def _entry(self, table_offset: int, i: int) -> Tuple[int, int]:
+        """ i-th (hash, offset) entry of a table
+        """
+        return SNAPSHOT_INDEX.unpack_from(
+            self.map, table_offset + i * SNAPSHOT_INDEX.size)
+
+
+class BinaryStorage(JournalStorage):
+    """ Binary snapshot, .db_<Class>.bin, plus the journal of JournalStorage
+
+    The snapshot is a BinarySnapshot, memory-mapped on first use of the
+    class: nothing is parsed at startup and objects are decoded only
+    when get() or select() reach them. Changes are appended to the
+    journal and kept in an in-memory overlay over the snapshot until
+    compaction writes a new snapshot, copying unchanged records as raw
+    bytes. changes() reads the journal lines other processes appended.
+
+    A class that only has a .db_<Class>.json snapshot is converted on
+    first use. Snapshots get a hash table for each attribute passed to
+    ensure_indexes, which select() uses for eq and in conditions.
+    """
+    lazy = True
+
+    def __init__(self, compact_interval: float = 60):
+        """ Initialize the engine and start the compaction thread
+        """
+        self._views = {}
+        self._attributes = {}
+        super().__init__(compact_interval)
+
+    def file_path(self, s_class: str) -> str:
+        """ Path of the binary snapshot of a class
+        """
+        return ".db_{}.bin".format(s_class)
+
+    def load(self, s_class: str) -> Dict[str, dict]:
+        """ Decode every object of a class
+        """
+        return {obj_id.decode(): json.loads(obj_json)
+                for obj_id, obj_json in self._merged(s_class)}
+
+    def dump(self, s_class: str, objs_json: Dict[str, dict]):
+        """ Write a new snapshot and empty the journal
+        """
+        with self._file_lock(s_class):
+            before = self.stamp(s_class)
+            write_snapshot(self.file_path(s_class), (
+                (obj_id.encode(), json.dumps(obj_json).encode())
+                for obj_id, obj_json in objs_json.items()),
+                self._attributes.get(s_class, ()))
+            self._truncate_journal(s_class)
+            self._views.pop(s_class, None)
+            return before, self.stamp(s_class)
+
+    def changes(self, s_class: str, since: tuple) -> Tuple[tuple, list]:
+        """ Catch up with the files; any change needs a reload
+        """
+        with self._file_lock(s_class):
+            stamp = self._refresh(s_class)["stamp"]
+        return stamp, ([] if stamp == since else None)
+
+    def upsert(self, s_class: str, obj_id: str, obj_json: dict,
+               snapshot: Snapshot = None):
+        """ Append an upsert line and apply it to the overlay
+        """
+        with self._lock:
+            written = super().upsert(s_class, obj_id, obj_json, snapshot)
+            self._view(s_class)["overlay"][obj_id] = obj_json
+            return written
+
+    def delete(self, s_class: str, obj_id: str, snapshot: Snapshot = None):
+        """ Append a delete line and apply it to the overlay
+        """
+        with self._lock:
+            written = super().delete(s_class, obj_id, snapshot)
+            self._view(s_class)["overlay"][obj_id] = None
+            return written
+
+    def compact(self, s_class: str):
+        """ Fold the journal into a new snapshot if this process wrote to it
+        """
+        with self._lock:
+            if s_class not in self._snapshots:
+                return
+            with self._file_lock(s_class):
+                self._refresh(s_class)
+                write_snapshot(self.file_path(s_class),
+                               self._merged(s_class),
+                               self._attributes.get(s_class, ()))
+                self._truncate_journal(s_class)
+                self._views.pop(s_class, None)
+
+    def ensure_indexes(self, s_class: str, attributes: Tuple[str, ...]):
+        """ Give the next snapshots of s_class a table for each attribute
+        """
+        self._attributes[s_class] = tuple(attributes)
+
+    def get(self, s_class: str, obj_id: str) -> Optional[dict]:
+        """ JSON of one object, None if there is none with this id
+        """
+        view = self._view(s_class)
+        if obj_id in view["overlay"]:
+            return view["overlay"][obj_id]
+        if view["snapshot"] is None:
+            return None
+        obj_json = view["snapshot"].find(obj_id.encode())
+        return json.loads(obj_json) if obj_json is not None else None
+
+    def select(self, s_class: str, conditions: List[tuple],
+               ordering: str = None, descending: bool = False,
+               limit: int = None, offset: int = 0) -> Iterator[dict]:
+        """ Lazily iterate over the JSON of the matching objects
+        """
+        records = None
+        snapshot = self._view(s_class)["snapshot"]
+        for attribute, op, value in conditions:
+            if snapshot is not None and attribute in snapshot.tables and \
+                    op in ('eq', 'in'):
+                records = snapshot.lookup(attribute,
+                                          [value] if op == 'eq' else value)
+                break
+        objs = (json.loads(obj_json)
+                for _, obj_json in self._merged(s_class, records))
+        if conditions:
+            objs = (obj for obj in objs
+                    if all(compare(obj.get(attribute), op, value)
+                           for attribute, op, value in conditions))
+        if ordering is not None:
+            objs = iter(sorted(objs, key=lambda obj: (
+                obj.get(ordering) is None, obj.get(ordering)),
+                reverse=descending))
+        stop = offset + limit if limit is not None else None
+        return islice(objs, offset, stop)
+
+    def count(self, s_class: str, conditions: List[tuple] = ()) -> int:
+        """ Number of objects matching conditions
+        """
+        if conditions:
+            return sum(1 for _ in self.select(s_class, conditions))
+        view = self._view(s_class)
+        snapshot = view["snapshot"]
+        count = snapshot.count if snapshot is not None else 0
+        for obj_id, obj_json in list(view["overlay"].items()):
+            stored = snapshot is not None and \
+                snapshot.find(obj_id.encode()) is not None
+            count += (obj_json is not None) - stored
+        return count
+
+    def _merged(self, s_class: str,
+                records: Iterator[Tuple[bytes, bytes]] = None
+                ) -> Iterator[Tuple[bytes, bytes]]:
+        """ (id, json) bytes of the snapshot records with the overlay
+
+        records restricts the snapshot records to some of them.
+        """
+        view = self._view(s_class)
+        overlay = dict(view["overlay"])
+        if records is None and view["snapshot"] is not None:
+            records = view["snapshot"].records()
+        if records is not None and not overlay:
+            yield from records
+        elif records is not None:
+            for obj_id, obj_json in records:
+                if obj_id.decode() not in overlay:
+                    yield obj_id, obj_json
+        for obj_id, obj_json in overlay.items():
+            if obj_json is not None:
+                yield obj_id.encode(), json.dumps(obj_json).encode()
+
+    def _view(self, s_class: str) -> dict:
+        """ Snapshot, overlay and stamp of a class, opened on first use
+        """
+        view = self._views.get(s_class)
+        if view is None:
+            with self._lock:
+                view = self._views.get(s_class)
+                if view is None:
+                    view = self._open(s_class)
+        return view
+
+    def _open(self, s_class: str) -> dict:
+        """ Map the snapshot of a class and replay its journal
+        """
+        with self._file_lock(s_class):
+            file_path = self.file_path(s_class)
+            json_path = super().file_path(s_class)
+            if not path.exists(file_path) and path.exists(json_path):
+                # the journal, if any, is replayed over it below
+                with open(json_path, 'r') as f:
+                    objs_json = json.load(f)
+                write_snapshot(file_path, (
+                    (obj_id.encode(), json.dumps(obj_json).encode())
+                    for obj_id, obj_json in objs_json.items()),
+                    self._attributes.get(s_class, ()))
+            view = {"snapshot": None, "overlay": {},
+                    "stamp": (self._file_stamp(file_path), None, 0)}
+            if path.exists(file_path):
+                view["snapshot"] = BinarySnapshot(file_path)
+            self._views[s_class] = view
+            self._replay(s_class, view, self.stamp(s_class))
+            return view
+
+    def _refresh(self, s_class: str) -> dict:
+        """ Reopen the class if its files were replaced, else read the
+        journal lines appended since the last look
+        """
+        view = self._view(s_class)
+        stamp = self.stamp(s_class)
+        seen = view["stamp"]
+        if stamp[0] != seen[0] or (seen[1] is not None and
+                                   (stamp[1] != seen[1] or
+                                    stamp[2] < seen[2])):
+            self._views.pop(s_class, None)
+            return self._view(s_class)
+        if stamp[2] > seen[2]:
+            self._replay(s_class, view, stamp)
+        return view
+
+    def _replay(self, s_class: str, view: dict, stamp: tuple):
+        """ Apply the journal lines between the view's position and stamp
+        """
+        start = view["stamp"][2]
+        if stamp[1] is None or stamp[2] <= start:
+            view["stamp"] = (stamp[0], stamp[1], start)
+            return
+        with open(self.journal_path(s_class), 'rb') as f:
+            f.seek(start)
+            data = f.read(stamp[2] - start)
+        # stop at the last complete line; the rest is read next time
+        data = data[:data.rfind(b"\n") + 1]
+        overlay = view["overlay"]
+        for entry in journal_entries(data):
+            overlay[entry["id"]] = entry.get("obj") \
+                if entry["op"] == "upsert" else None
+        view["stamp"] = (stamp[0], stamp[1], start + len(data))
+
+
+def read_shard(file_path: str) -> Dict[str, dict]:
+    """ {id: json} of one shard file, run in the loader processes
+    """
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+
+class ShardedStorage(FileStorage):
+    """ The objects of a class spread over shards JSON files by id hash
+
+    Object obj_id lives in .db_<Class>.<n>.json with n the id_hash of
+    obj_id modulo shards, so a change rewrites one shard only.
+    The first load_shards() of a class parses its shards in a pool of
+    workers processes and yields each one as soon as it is read, letting
+    the caller build objects while the other shards are still being
+    parsed. The pool is forked, and only while this process runs no
+    other thread (timers, sweepers...) that the copies could inherit
+    mid-operation; spawned workers would re-run the __main__ module.
+    It is closed once the class is loaded: later reloads, after another
+    process changed the files, read the shards in this process. A class
+    that only has a .db_<Class>.json file is read from it and split on
+    its next dump.
+
+    Shards are found by name when loading; after changing the number of
+    shards, save_to_file() redistributes the objects.
+    """
+
+    def __init__(self, shards: int = 8, workers: int = None):
+        """ Initialize the engine
+        """
+        super().__init__()
+        self.shards = shards
+        self.workers = workers if workers is not None else os.cpu_count()
+        self._loaded = set()
+
+    def shard_path(self, s_class: str, shard: int) -> str:
+        """ Path of one shard of a class
+        """
+        return ".db_{}.{}.json".format(s_class, shard)
+
+    def shard_of(self, obj_id: str) -> int:
+        """ Shard holding obj_id
+        """
+        return id_hash(obj_id.encode()) % self.shards
+
+    def load(self, s_class: str) -> Dict[str, dict]:
+        """ Read every shard of a class
+        """
+        objs_json = {}
+        for _, _, shard in self.load_shards(s_class):
+            objs_json.update(shard)
+        return objs_json
+
+    def load_shards(self, s_class: str) -> Iterator[Tuple[int, int, dict]]:
+        """ Read the shards of a class, in parallel on its first load,
+        yielding each one
+        """
+        cold = s_class not in self._loaded
+        self._loaded.add(s_class)
+        paths = self._shard_paths(s_class)
+        if not paths:
+            yield 1, 1, super().load(s_class)
+            return
+        if not cold or self.workers <= 1 or len(paths) == 1 or \
+                threading.active_count() > 1 or \
+                "fork" not in multiprocessing.get_all_start_methods():
+            for done, file_path in enumerate(paths, 1):
+                yield done, len(paths), read_shard(file_path)
+            return
+        with ProcessPoolExecutor(min(self.workers, len(paths)),
+                                 multiprocessing.get_context("fork")) as pool:
+            futures = [pool.submit(read_shard, file_path)
+                       for file_path in paths]
+            for done, future in enumerate(as_completed(futures), 1):
+                yield done, len(paths), future.result()
+
+    def dump(self, s_class: str, objs_json: Dict[str, dict]):
+        """ Split objs_json into the shards and write them all
+        """
+        shards = [{} for _ in range(self.shards)]
+        for obj_id, obj_json in objs_json.items():
+            shards[self.shard_of(obj_id)][obj_id] = obj_json
+        with self._lock:
+            before = self.stamp(s_class)
+            for shard, shard_json in enumerate(shards):
+                self._dump_file(self.shard_path(s_class, shard), shard_json)
+            for file_path in self._shard_paths(s_class):
+                if int(file_path.rsplit(".", 2)[1]) >= self.shards:
+                    os.unlink(file_path)
+            if path.exists(super().file_path(s_class)):
+                os.unlink(super().file_path(s_class))
+            return before, self.stamp(s_class)
+
+    def stamp(self, s_class: str) -> tuple:
+        """ Stamps of the shard files, or of the unsharded file
+        """
+        return tuple(self._file_stamp(file_path) for file_path in
+                     self._shard_paths(s_class) or [self.file_path(s_class)])
+
+    def upsert(self, s_class: str, obj_id: str, obj_json: dict,
+               snapshot: Snapshot):
+        """ Rewrite the shard of the saved object
+        """
+        return self._update(s_class, obj_id, obj_json, snapshot)
+
+    def delete(self, s_class: str, obj_id: str, snapshot: Snapshot):
+        """ Rewrite the shard of the removed object
+        """
+        return self._update(s_class, obj_id, None, snapshot)
+
+    def _shard_paths(self, s_class: str) -> List[str]:
+        """ Existing shard files of a class, in shard order
+        """
+        paths = glob.glob(glob.escape(".db_{}.".format(s_class)) +
+                          "[0-9]*.json")
+        return sorted(paths, key=lambda p: int(p.rsplit(".", 2)[1]))
+
+    def _update(self, s_class: str, obj_id: str, obj_json: Optional[dict],
+                snapshot: Snapshot):
+        """ Apply one change to its shard, None meaning a removal
+        """
+        with self._lock:
+            if not self._shard_paths(s_class):
+                return self.dump(s_class, snapshot())
+            before = self.stamp(s_class)
+            file_path = self.shard_path(s_class, self.shard_of(obj_id))
+            shard_json = read_shard(file_path) \
+                if path.exists(file_path) else {}
+            if obj_json is None:
+                shard_json.pop(obj_id, None)
+            else:
+                shard_json[obj_id] = obj_json
+            self._dump_file(file_path, shard_json)
+            return before, self.stamp(s_class)
+
+
+class SQLiteStorage():
+    """ One SQLite table per class, "<Class>"(id, data), in one database
+
+    data is the JSON of the object. The attributes passed to
+    ensure_indexes get an index on json_extract(data, '$.<attribute>'),
+    which select() and count() use for their conditions and ordering, so
+    objects are read one query at a time instead of loaded up front and
+    a class can be larger than memory. Every change is one transaction
+    on one row. The database runs in WAL mode, with one connection per
+    thread; a per-class version row, bumped by every write, gives the
+    stamp.
+    """
+    lazy = True
+    SQL_OPERATORS = {'eq': '=', 'lt': '<', 'lte': '<=', 'gt': '>',
+                     'gte': '>='}
+
+    def __init__(self, db_path: str = ".db_models.sqlite3"):
+        """ Open the database
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._tables = set()
+        self._lock = threading.Lock()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS versions"
+            " (class TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def load(self, s_class: str) -> Dict[str, dict]:
+        """ Read every object of a class
+        """
+        return {row[0]: json.loads(row[1]) for row in self._execute(
+            s_class, 'SELECT id, data FROM "{}" ORDER BY rowid')}
+
+    def dump(self, s_class: str, objs_json: Dict[str, dict]):
+        """ Replace the content of the table of a class
+        """
+        return self._write(s_class, [
+            ('DELETE FROM "{}"', ()),
+        ] + [
+            ('INSERT INTO "{}" (id, data) VALUES (?, ?)',
+             (obj_id, json.dumps(obj_json)))
+            for obj_id, obj_json in objs_json.items()
+        ])
+
+    def upsert(self, s_class: str, obj_id: str, obj_json: dict,
+               snapshot: Snapshot = None):
+        """ Insert or update one row
+        """
+        return self._write(s_class, [(
+            'INSERT INTO "{}" (id, data) VALUES (?, ?)'
+            ' ON CONFLICT(id) DO UPDATE SET data = excluded.data',
+            (obj_id, json.dumps(obj_json)))])
+
+    def delete(self, s_class: str, obj_id: str, snapshot: Snapshot = None):
+        """ Delete one row
+        """
+        return self._write(s_class, [('DELETE FROM "{}" WHERE id = ?',
+                                      (obj_id,))])
+
+    def flush(self, s_class: str = None):
+        """ Every change is committed when made
+        """
+
+    def stamp(self, s_class: str) -> tuple:
+        """ Version of the class, bumped by every write
+        """
+        row = self._connection().execute(
+            "SELECT version FROM versions WHERE class = ?",
+            (s_class,)).fetchone()
+        return (row[0] if row is not None else 0,)
+
+    def changes(self, s_class: str, since: tuple) -> Tuple[tuple, list]:
+        """ Objects are read from the database; a change needs a reload
+        """
+        stamp = self.stamp(s_class)
+        return stamp, ([] if stamp == since else None)
+
+    def ensure_indexes(self, s_class: str, attributes: Tuple[str, ...]):
+        """ Index the table of s_class on each of attributes
+        """
+        self._table(s_class)
+        conn = self._connection()
+        for attribute in attributes:
+            conn.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}"'
+                         ' ON "{0}" ({2})'.format(
+                             s_class, attribute, self._column(attribute)))
+
+    def get(self, s_class: str, obj_id: str) -> Optional[dict]:
+        """ JSON of one object, None if there is none with this id
+        """
+        row = self._execute(s_class, 'SELECT data FROM "{}" WHERE id = ?',
+                            (obj_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def select(self, s_class: str, conditions: List[tuple],
+               ordering: str = None, descending: bool = False,
+               limit: int = None, offset: int = 0) -> Iterator[dict]:
+        """ Lazily iterate over the JSON of the matching objects
+        """
+        where, params = self._where(conditions)
+        sql = 'SELECT data FROM "{}"' + where
+        if ordering is not None:
+            column = self._column(ordering)
+            direction = " DESC" if descending else ""
+            # no "IS NULL" term: it would stop SQLite from walking the
+            # index in order, at the cost of NULLs sorting first
+            sql += " ORDER BY {0}{1}, rowid{1}".format(column, direction)
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit if limit is not None else -1, offset]
+        for row in self._execute(s_class, sql, params):
+            yield json.loads(row[0])
+
+    def count(self, s_class: str, conditions: List[tuple] = ()) -> int:
+        """ Number of objects matching conditions
+        """
+        where, params = self._where(conditions)
+        return self._execute(s_class, 'SELECT COUNT(*) FROM "{}"' + where,
+                             params).fetchone()[0]
+
+    @staticmethod
+    def _column(attribute: str) -> str:
+        """ SQL expression reading attribute from the data column
+        """
+        if not attribute.isidentifier():
+            raise ValueError("Invalid attribute: {}".format(attribute))
+        return "json_extract(data, '$.{}')".format(attribute)
+
+    def _where(self, conditions: List[tuple]) -> Tuple[str, list]:
+        """ WHERE clause and parameters of query conditions
+        """
+        clauses = []
+        params = []
+        for attribute, op, value in conditions:
+            column = self._column(attribute)
+            if op == 'eq' and value is None:
+                clauses.append("{} IS NULL".format(column))
+            elif op in self.SQL_OPERATORS:
+                clauses.append("{} {} ?".format(column,
+                                                self.SQL_OPERATORS[op]))
+                params.append(value)
+            elif op == 'in':
+                clauses.append("{} IN ({})".format(
+                    column, ", ".join("?" * len(value))))
+                params.extend(value)
+            elif op == 'range':
+                clauses.append("{} BETWEEN ? AND ?".format(column))
+                params.extend(value)
+            elif op == 'prefix':
+                clauses.append("substr({}, 1, ?) = ?".format(column))
+                params.extend((len(value), value))
+            else:
+                raise ValueError("Unknown query operator: {}".format(op))
+        if not clauses:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    def _execute(self, s_class: str, sql: str,
+                 params: tuple = ()) -> sqlite3.Cursor:
+        """ Run sql, whose "{}" is the table of s_class
+        """
+        self._table(s_class)
+        return self._connection().execute(sql.format(s_class), params)
+
+    def _write(self, s_class: str,
+               statements: List[tuple]) -> Tuple[tuple, tuple]:
+        """ Run statements and bump the class version in one transaction
+        """
+        self._table(s_class)
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = self.stamp(s_class)
+            for sql, params in statements:
+                conn.execute(sql.format(s_class), params)
+            conn.execute(
+                "INSERT INTO versions VALUES (?, 1) ON CONFLICT(class)"
+                " DO UPDATE SET version = version + 1", (s_class,))
+        return before, (before[0] + 1,)
+
+    def _table(self, s_class: str):
+        """ Create the table of s_class on first use
+        """
+        if s_class in self._tables:
+            return
+        with self._lock:
+            self._connection().execute(
+                'CREATE TABLE IF NOT EXISTS "{}"'
+                ' (id TEXT PRIMARY KEY, data TEXT NOT NULL)'.format(s_class))
+            self._tables.add(s_class)
+
+    def _connection(self) -> sqlite3.Connection:
+        """ The connection of the calling thread
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> FileStorage:
+    """ Return the engine selected by MODELS_STORAGE
+
+    "file" (default) rewrites .db_<Class>.json on every change, or
+    MODELS_WRITE_DELAY seconds after the first of a burst of changes
+    when that is set; "journal" appends to .db_<Class>.journal and
+    compacts every MODELS_JOURNAL_COMPACT_INTERVAL seconds (default 60);
+    "sharded" splits each class over MODELS_SHARDS files (default 8),
+    loaded by MODELS_LOAD_WORKERS processes (default: one per core);
+    "binary" is "journal" with memory-mapped binary snapshots read on
+    demand; "sqlite" keeps every class in the MODELS_SQLITE_PATH database
+    (default .db_models.sqlite3) and reads objects on demand.
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                engine = getenv("MODELS_STORAGE", "file")
+                if engine == "file":
+                    delay = float(getenv("MODELS_WRITE_DELAY", 0))
+                    _storage = FileStorage(delay)
+                elif engine == "journal":
+                    interval = float(getenv(
+                        "MODELS_JOURNAL_COMPACT_INTERVAL", 60))
+                    _storage = JournalStorage(interval)
+                elif engine == "sharded":
+                    workers = getenv("MODELS_LOAD_WORKERS")
+                    _storage = ShardedStorage(
+                        int(getenv("MODELS_SHARDS", 8)),
+                        int(workers) if workers else None)
+                elif engine == "binary":
+                    interval = float(getenv(
+                        "MODELS_JOURNAL_COMPACT_INTERVAL", 60))
+                    _storage = BinaryStorage(interval)
+                elif engine == "sqlite":
+                    _storage = SQLiteStorage(getenv(
+                        "MODELS_SQLITE_PATH", ".db_models.sqlite3"))
+                else:
+                    raise ValueError(
+                        "Unknown MODELS_STORAGE: {}".format(engine))
+    return _storage
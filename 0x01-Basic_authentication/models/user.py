@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 """ User module
 """
-import hashlib
-from models.base import Base
+from models.base import Base, model_slots
+from models.password_hashers import hash_password, verify_password
 
 
 class User(Base):
     """ User class
     """
+    __slots__ = model_slots('email', '_password', 'first_name', 'last_name')
+    INDEXED_ATTRIBUTES = ('email',)
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
@@ -26,22 +28,30 @@ class User(Base):
 
     @password.setter
     def password(self, pwd: str):
-        """ Setter of a new password: encrypt in SHA256
+        """ Setter of a new password: hashed with the scheme selected by
+        USER_PASSWORD_HASHER (see models.password_hashers)
         """
         if pwd is None or type(pwd) is not str:
             self._password = None
         else:
-            self._password = hashlib.sha256(pwd.encode()).hexdigest().lower()
+            self._password = hash_password(pwd)
 
     def is_valid_password(self, pwd: str) -> bool:
         """ Validate a password
+
+        A valid password stored with another scheme or weaker settings
+        than the configured ones is rehashed, and saved if the user is.
         """
         if pwd is None or type(pwd) is not str:
             return False
         if self.password is None:
             return False
-        pwd_e = pwd.encode()
-        return hashlib.sha256(pwd_e).hexdigest().lower() == self.password
+        valid, needs_rehash = verify_password(pwd, self.password)
+        if needs_rehash:
+            self.password = pwd
+            if User.get(self.id) is self:
+                self.save()
+        return valid
 
     def display_name(self) -> str:
         """ Display User name based on email/first_name/last_name
@@ -15,6 +15,12 @@ app.register_blueprint(app_views)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 auth = None
 AUTH_TYPE = os.getenv("AUTH_TYPE")
+EXCLUDED_PATHS: List[str] = [
+    '/api/v1/status/',
+    '/api/v1/unauthorized/',
+    '/api/v1/forbidden/',
+    '/api/v1/auth_session/login/'
+]
 
 if AUTH_TYPE == "auth":
     from api.v1.auth.auth import Auth
@@ -41,6 +47,11 @@ elif AUTH_TYPE == "session_db_auth":
 
     auth = SessionDBAuth()
 
+elif AUTH_TYPE == "session_token_auth":
+    from api.v1.auth.session_token_auth import SessionTokenAuth
+
+    auth = SessionTokenAuth()
+
 
 @app.before_request
 def before_request() -> str:
@@ -48,14 +59,7 @@ def before_request() -> str:
     if auth is None:
         return
 
-    excluded_paths: List[str] = [
-        '/api/v1/status/',
-        '/api/v1/unauthorized/',
-        '/api/v1/forbidden/',
-        '/api/v1/auth_session/login/'
-    ]
-
-    if not auth.require_auth(request.path, excluded_paths):
+    if not auth.require_auth(request.path, EXCLUDED_PATHS):
         return
 
     if auth.authorization_header(request) is None\
@@ -1,32 +1,37 @@
 #!/usr/bin/env python3
 """Auth class created"""
-from flask import request
+from api.v1.auth.path_matcher import PathMatcher
+from flask import g, has_request_context, request
 from typing import List, TypeVar
 import os
 
 
 class Auth:
-    """Class to manage api authentications"""
+    """Class to manage api authentications
+
+    Values resolved while serving a request (session id, user id, user)
+    are memoised in request_cache() so each is looked up at most once.
+    """
 
     def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
-        """require auth paths"""
+        """require auth paths
+
+        excluded_paths is compiled into a PathMatcher once and reused for
+        as long as the same list object is passed in.
+        """
         if path is None or excluded_paths is None or excluded_paths == []:
             return True
 
-        if path in excluded_paths:
-            return False
-
-        slashless_exclude_paths: List[str] = []
-        asterik_exclude_paths: List[str] = []
+        return not self._path_matcher(excluded_paths).match(path)
 
-        for new_path in excluded_paths:
-            slashless_exclude_paths.append(new_path[:-1])
+    def _path_matcher(self, excluded_paths: List[str]) -> PathMatcher:
+        """compiled matcher of excluded_paths, cached on the instance"""
+        cached = getattr(self, '_excluded_paths_matcher', None)
+        if cached is None or cached[0] is not excluded_paths:
+            cached = (excluded_paths, PathMatcher(excluded_paths))
+            self._excluded_paths_matcher = cached
 
-        for new_path in slashless_exclude_paths:
-            if path.startswith(new_path):
-                return False
-
-        return True
+        return cached[1]
 
     def authorization_header(self, request=None) -> str:
         """Authorization header"""
@@ -49,8 +54,28 @@ class Auth:
         if request is None:
             return None
 
+        cache = self.request_cache()
+        if cache is not None and 'session_id' in cache:
+            return cache['session_id']
+
         SESSION_NAME = os.getenv("SESSION_NAME")
 
         cookie = request.cookies.get(SESSION_NAME)
 
+        if cache is not None:
+            cache['session_id'] = cookie
+
         return cookie
+
+    def request_cache(self) -> dict:
+        """memo dict stored on flask.g for the current request,
+        None outside of a request"""
+        if not has_request_context():
+            return None
+
+        cache = g.get('_auth_cache')
+        if cache is None:
+            cache = {}
+            g._auth_cache = cache
+
+        return cache
@@ -1,13 +1,35 @@
 #!/usr/bin/env python3
 """A class that inherits from Auth class"""
 from api.v1.auth.auth import Auth
+from api.v1.auth.credential_cache import CredentialCache
 from base64 import b64decode
 from typing import List, TypeVar
 from models.user import User
+import os
 
 
 class BasicAuth(Auth):
-    """Inherits from Auth"""
+    """Inherits from Auth
+
+    Verified headers are cached for BASIC_AUTH_CACHE_TTL seconds
+    (default 300, 0 disables) in up to BASIC_AUTH_CACHE_SIZE entries
+    (default 10000), so repeated requests skip decoding, the user
+    search and the password check.
+    """
+    def __init__(self):
+        """Init the verified-credential cache"""
+        try:
+            ttl = float(os.getenv('BASIC_AUTH_CACHE_TTL'))
+        except Exception:
+            ttl = 300
+
+        try:
+            max_size = int(os.getenv('BASIC_AUTH_CACHE_SIZE'))
+        except Exception:
+            max_size = 10000
+
+        self.credential_cache = CredentialCache(ttl, max_size)
+
     def extract_base64_authorization_header(
         self,
         authorization_header: str
@@ -96,6 +118,10 @@ class BasicAuth(Auth):
         if not auth_header:
             return None
 
+        user = self.credential_cache.get(auth_header)
+        if user is not None:
+            return user
+
         extract_auth_header: str = self.extract_base64_authorization_header(
             auth_header
         )
@@ -125,4 +151,5 @@ class BasicAuth(Auth):
         if not user:
             return None
 
+        self.credential_cache.put(auth_header, user)
         return user
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Cache of verified Basic auth credentials"""
+from collections import OrderedDict
+from typing import TypeVar
+from models.user import User
+import hashlib
+import os
+import threading
+import time
+
+
+class CredentialCache:
+    """Bounded, expiring map of Authorization header -> verified user
+
+    Headers are stored as a keyed BLAKE2b digest (the key is random and
+    never leaves the process), so the cache holds no usable credentials.
+    Each entry remembers the user's email and password hash when it was
+    verified: a hit is only served while User.get(user_id) still exists
+    with that same email and hash, so an email or password change or a
+    removal through User invalidates it. At most max_size entries are
+    kept, least recently used evicted first, each for at most ttl
+    seconds.
+    """
+
+    def __init__(self, ttl: float = 300, max_size: int = 10000):
+        """init an empty cache"""
+        self.ttl = ttl
+        self.max_size = max_size
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, auth_header: str) -> TypeVar('User'):
+        """user previously verified with this exact header, or None"""
+        if self.ttl <= 0:
+            return None
+
+        digest = self._digest(auth_header)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            user_id, email, password, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+
+        try:
+            user = User.get(user_id)
+        except Exception:
+            user = None
+
+        if user is None or user.email != email or \
+                user.password != password:
+            with self._lock:
+                self._entries.pop(digest, None)
+            return None
+
+        return user
+
+    def put(self, auth_header: str, user: TypeVar('User')):
+        """remember that auth_header authenticates user"""
+        if self.ttl <= 0:
+            return
+
+        entry = (user.id, user.email, user.password,
+                 time.monotonic() + self.ttl)
+        digest = self._digest(auth_header)
+        with self._lock:
+            self._entries[digest] = entry
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """forget every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def _digest(self, auth_header: str) -> bytes:
+        """keyed hash of a header"""
+        return hashlib.blake2b(auth_header.encode(), key=self._key,
+                               digest_size=16).digest()
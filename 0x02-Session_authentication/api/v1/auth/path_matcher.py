@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Matcher for the paths excluded from authentication"""
+from typing import List
+import re
+
+
+class PathMatcher:
+    """Compiled form of an excluded_paths list
+
+    A pattern excludes every path starting with it, a trailing slash
+    being optional ("/api/v1/status/" excludes "/api/v1/status" and
+    "/api/v1/status/x"). "*" matches any run of characters, so
+    "/api/v1/stat*" excludes "/api/v1/stats" and "/api/v1/status".
+
+    Plain prefixes (including ones whose only "*" is the last character)
+    go into a character trie, walked once per path, so matching costs
+    O(len(path)) whatever the number of patterns. Patterns with a "*"
+    elsewhere are folded into a single compiled regex.
+    """
+    END = ""
+
+    def __init__(self, excluded_paths: List[str]):
+        """compile the patterns"""
+        self.trie = {}
+        wildcards = []
+
+        for pattern in excluded_paths:
+            if pattern.endswith("*"):
+                pattern = pattern[:-1]
+            elif pattern.endswith("/"):
+                pattern = pattern[:-1]
+
+            if "*" in pattern:
+                wildcards.append(
+                    ".*".join(re.escape(part) for part in pattern.split("*"))
+                )
+                continue
+
+            node = self.trie
+            for char in pattern:
+                node = node.setdefault(char, {})
+            node[self.END] = True
+
+        self.regex = None
+        if wildcards:
+            self.regex = re.compile("|".join(wildcards))
+
+    def match(self, path: str) -> bool:
+        """True if path is excluded"""
+        node = self.trie
+        if self.END in node:
+            return True
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            if self.END in node:
+                return True
+
+        return self.regex is not None and \
+            self.regex.match(path) is not None
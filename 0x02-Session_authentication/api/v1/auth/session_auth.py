@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 """A classs SessionAuth that inherits from AUTH"""
 from api.v1.auth.auth import Auth
+from api.v1.auth.session_backends import create_session_backend
 from uuid import uuid4
 from models.user import User
 
 
 class SessionAuth(Auth):
-    """Session auth class with a class attribute"""
+    """Session auth class with a class attribute
+
+    Each instance replaces the class-level dict with the session backend
+    selected by SESSION_BACKEND (see api.v1.auth.session_backends).
+    """
     user_id_by_session_id = {}
 
+    def __init__(self):
+        """plug in the configured session backend"""
+        self.user_id_by_session_id = create_session_backend()
+
     def create_session(self, user_id: str = None) -> str:
         """creates a session id for a user"""
         if user_id is None:
@@ -32,24 +41,51 @@ class SessionAuth(Auth):
             return None
 
         user_id = self.user_id_by_session_id.get(session_id)
+        if isinstance(user_id, dict):
+            return user_id.get('user_id')
 
         return user_id
 
+    def cached_user_id_for_session_id(self, session_id: str) -> str:
+        """user_id_for_session_id, looked up once per request"""
+        cache = self.request_cache()
+        if cache is None:
+            return self.user_id_for_session_id(session_id)
+
+        key = ('user_id', session_id)
+        if key not in cache:
+            cache[key] = self.user_id_for_session_id(session_id)
+
+        return cache[key]
+
+    def forget_request_session(self, session_id: str):
+        """drop what the current request memoised about a session"""
+        cache = self.request_cache()
+        if cache is None:
+            return
+
+        cache.pop(('user_id', session_id), None)
+        cache.pop('current_user', None)
+
     def current_user(self, request=None):
         """return user based on session id and user_id"""
+        cache = self.request_cache()
+        if cache is not None and 'current_user' in cache:
+            return cache['current_user']
+
+        user = None
         session_id = self.session_cookie(request)
 
         if session_id is not None:
-            user_id = self.user_id_for_session_id(session_id)
+            user_id = self.cached_user_id_for_session_id(session_id)
             if user_id is not None:
 
                 user = User.get(user_id)
 
-                return user
-
-            return None
+        if cache is not None:
+            cache['current_user'] = user
 
-        return None
+        return user
 
     def destroy_session(self, request=None):
         """deletes user session or log outs user"""
@@ -60,9 +96,10 @@ class SessionAuth(Auth):
         if session_id is None:
             return False
 
-        user_id = self.user_id_for_session_id(session_id)
+        user_id = self.cached_user_id_for_session_id(session_id)
         if user_id is None:
             return False
 
         del self.user_id_by_session_id[session_id]
+        self.forget_request_session(session_id)
         return True
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""Session backends SessionAuth and its subclasses can store sessions in
+
+Every backend is a MutableMapping of session id -> session data, the
+same interface as the plain dict SessionAuth started with, holding
+either a user id string (SessionAuth) or a {"user_id", "created_at"}
+dict (SessionExpAuth). The backend is chosen with SESSION_BACKEND:
+  - memory (default): private to the process, a plain dict, or a
+    SessionStore when sessions expire or are capped
+  - sqlite: SQLiteSessionBackend on SESSION_SQLITE_PATH, in WAL mode so
+    every worker process on the host can share it
+  - redis: RedisSessionBackend on SESSION_REDIS_URL, shared by every
+    worker that can reach the server
+"""
+from api.v1.auth.session_store import SessionStore
+from collections.abc import MutableMapping
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
+from urllib.parse import urlparse
+import json
+import os
+import select
+import socket
+import sqlite3
+import threading
+import time
+
+
+def encode_session(value) -> Tuple[str, Optional[float]]:
+    """split session data into a user id and a created_at timestamp"""
+    if isinstance(value, dict):
+        created_at = value.get("created_at")
+        if created_at is not None:
+            created_at = created_at.timestamp()
+        return value.get("user_id"), created_at
+    return value, None
+
+
+def decode_session(user_id: str, created_at: Optional[float]):
+    """rebuild the session data encode_session was given"""
+    if created_at is None:
+        return user_id
+    return {
+        "user_id": user_id,
+        "created_at": datetime.fromtimestamp(created_at)
+    }
+
+
+class SQLiteSessionBackend(MutableMapping):
+    """Sessions in a SQLite table shared by every process on the host
+
+    The database runs in WAL mode so readers never wait for a writer.
+    Each thread gets its own connection. Sessions older than ttl seconds
+    are ignored by lookups and deleted whenever a session is written.
+    """
+
+    def __init__(self, path: str, ttl: float = 0):
+        """open the database and create the sessions table"""
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._connection().executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " user_id TEXT,"
+            " created_at REAL,"
+            " expires_at REAL);"
+            "CREATE INDEX IF NOT EXISTS sessions_expires_at"
+            " ON sessions (expires_at);"
+        )
+
+    def __setitem__(self, session_id: str, value):
+        """insert or replace a session and sweep expired ones"""
+        user_id, created_at = encode_session(value)
+        expires_at = time.time() + self.ttl if self.ttl > 0 else None
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+            (session_id, user_id, created_at, expires_at)
+        )
+        self.sweep()
+
+    def __getitem__(self, session_id: str):
+        """return a live session"""
+        row = self._connection().execute(
+            "SELECT user_id, created_at FROM sessions WHERE session_id = ?"
+            " AND (expires_at IS NULL OR expires_at > ?)",
+            (session_id, time.time())
+        ).fetchone()
+        if row is None:
+            raise KeyError(session_id)
+        return decode_session(*row)
+
+    def __delitem__(self, session_id: str):
+        """remove a session"""
+        cursor = self._connection().execute(
+            "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+        )
+        if cursor.rowcount == 0:
+            raise KeyError(session_id)
+
+    def __iter__(self) -> Iterator[str]:
+        """iterate over live session ids"""
+        rows = self._connection().execute(
+            "SELECT session_id FROM sessions"
+            " WHERE expires_at IS NULL OR expires_at > ?", (time.time(),)
+        ).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        """number of live sessions"""
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM sessions"
+            " WHERE expires_at IS NULL OR expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+
+    def sweep(self) -> int:
+        """delete expired sessions, return how many were deleted"""
+        return self._connection().execute(
+            "DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)
+        ).rowcount
+
+    def _connection(self) -> sqlite3.Connection:
+        """the connection of the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class RedisError(Exception):
+    """error reply from a Redis server"""
+
+
+class RedisSessionBackend(MutableMapping):
+    """Sessions in any server speaking the Redis protocol (RESP)
+
+    Only GET, SET, DEL, SCAN and SELECT are used, so the real server and
+    local stand-ins work alike. Each session is a JSON value under
+    prefix + session id, expired by the server itself when ttl > 0.
+    Each thread keeps its own connection, replaced when the server has
+    closed it or a command fails to go out.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 6379,
+                 db: int = 0, ttl: float = 0, prefix: str = "session:",
+                 timeout: float = 5):
+        """remember the server address; connections are opened lazily"""
+        self.host = host
+        self.port = port
+        self.db = db
+        self.ttl = ttl
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url: str, ttl: float = 0) -> 'RedisSessionBackend':
+        """build a backend from redis://host:port/db"""
+        parsed = urlparse(url)
+        db = parsed.path.lstrip("/")
+        return cls(parsed.hostname or "localhost", parsed.port or 6379,
+                   int(db) if db else 0, ttl)
+
+    def __setitem__(self, session_id: str, value):
+        """store a session, with a server-side expiry when ttl > 0"""
+        user_id, created_at = encode_session(value)
+        payload = json.dumps({"user_id": user_id, "created_at": created_at})
+        if self.ttl > 0:
+            self.command("SET", self.prefix + session_id, payload,
+                         "PX", int(self.ttl * 1000))
+        else:
+            self.command("SET", self.prefix + session_id, payload)
+
+    def __getitem__(self, session_id: str):
+        """return a live session"""
+        payload = self.command("GET", self.prefix + session_id)
+        if payload is None:
+            raise KeyError(session_id)
+        data = json.loads(payload)
+        return decode_session(data["user_id"], data["created_at"])
+
+    def __delitem__(self, session_id: str):
+        """remove a session"""
+        if self.command("DEL", self.prefix + session_id) == 0:
+            raise KeyError(session_id)
+
+    def __iter__(self) -> Iterator[str]:
+        """iterate over session ids with SCAN"""
+        cursor = b"0"
+        start = len(self.prefix)
+        while True:
+            cursor, keys = self.command("SCAN", cursor, "MATCH",
+                                        self.prefix + "*", "COUNT", 1000)
+            for key in keys:
+                yield key.decode()[start:]
+            if cursor == b"0":
+                return
+
+    def __len__(self) -> int:
+        """number of sessions; walks the keyspace"""
+        return sum(1 for _ in self)
+
+    def command(self, *args):
+        """send one command and return its decoded reply
+
+        Only a failed connect or send is retried, on a new connection:
+        once the request is out the server may have run it, and a DEL
+        run twice would answer 0 and look like a missing session.
+        """
+        request = self._encode(args)
+        for attempt in (0, 1):
+            try:
+                sock, reader = self._connection()
+                sock.sendall(request)
+                break
+            except OSError:
+                self._close()
+                if attempt:
+                    raise
+        try:
+            return self._read_reply(reader)
+        except OSError:
+            self._close()
+            raise
+
+    def _connection(self):
+        """the socket and reader of the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._stale(conn[0]):
+            self._close()
+            conn = None
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port),
+                                            self.timeout)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.db:
+                sock.sendall(self._encode(("SELECT", self.db)))
+                self._read_reply(conn[1])
+        return conn
+
+    @staticmethod
+    def _stale(sock: socket.socket) -> bool:
+        """whether an idle connection was closed by the server: between
+        commands nothing is pending, so a readable socket is at EOF"""
+        try:
+            return bool(select.select([sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def _close(self):
+        """drop the connection of the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        """encode a command as a RESP array of bulk strings"""
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    @classmethod
+    def _read_reply(cls, reader):
+        """read one RESP reply"""
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            return reader.read(length + 2)[:-2]
+        if kind == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [cls._read_reply(reader) for _ in range(length)]
+        raise RedisError("unexpected reply: {!r}".format(line))
+
+
+def create_session_backend(ttl: float = 0, max_size: int = 0,
+                           sweep_interval: float = 60) -> MutableMapping:
+    """build the backend selected by SESSION_BACKEND
+
+    ttl is the session lifetime in seconds (0 for none); max_size and
+    sweep_interval only apply to the in-process memory backend, which is
+    a plain dict when there is neither a lifetime nor a size bound.
+    """
+    backend = os.getenv("SESSION_BACKEND", "memory")
+
+    if backend == "memory":
+        if ttl <= 0 and max_size <= 0:
+            return {}
+        return SessionStore(ttl=ttl, max_size=max_size,
+                            sweep_interval=sweep_interval)
+
+    if backend == "sqlite":
+        path = os.getenv("SESSION_SQLITE_PATH", ".db_sessions.sqlite3")
+        return SQLiteSessionBackend(path, ttl)
+
+    if backend == "redis":
+        url = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+        return RedisSessionBackend.from_url(url, ttl)
+
+    raise ValueError("Unknown SESSION_BACKEND: {}".format(backend))
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """"saving the session id and user id to a database like a file"""
 from api.v1.auth.session_exp_auth import SessionExpAuth
+from api.v1.auth.session_store import SessionStore
 from datetime import datetime, timedelta
 from models.user_session import UserSession
 
@@ -25,11 +26,23 @@ class SessionDBAuth(SessionExpAuth):
         return session_id
 
     def user_id_for_session_id(self, session_id=None):
-        """Get user id depending on session_id"""
+        """Get user id depending on session_id
+
+        A shared session backend (sqlite, redis) is asked first and the
+        file database only for sessions it does not know. The in-process
+        memory backend is skipped: a logout handled by another worker
+        would not show up in it.
+        """
         if session_id is None:
             return None
 
-        UserSession.load_from_file()
+        if not isinstance(self.user_id_by_session_id,
+                          (dict, SessionStore)):
+            user_id = super().user_id_for_session_id(session_id)
+            if user_id is not None:
+                return user_id
+
+        UserSession.reload_if_changed()
         sessions = UserSession.search({
             'session_id': session_id
         })
@@ -56,7 +69,7 @@ class SessionDBAuth(SessionExpAuth):
         if session_id is None:
             return False
 
-        user_id = self.user_id_for_session_id(session_id)
+        user_id = self.cached_user_id_for_session_id(session_id)
 
         if not user_id:
             return False
@@ -69,10 +82,11 @@ class SessionDBAuth(SessionExpAuth):
             return False
 
         session = sessions[0]
+        self.user_id_by_session_id.pop(session_id, None)
+        self.forget_request_session(session_id)
 
         try:
             session.remove()
-            UserSession.save_to_file()
         except Exception:
             return False
 
@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 """Session authentication with expiration date"""
 from api.v1.auth.session_auth import SessionAuth
+from api.v1.auth.session_backends import create_session_backend
 from datetime import datetime, timedelta
 import os
 
 
 class SessionExpAuth(SessionAuth):
-    """SessionExpAuth class"""
+    """SessionExpAuth class
+
+    Sessions live in the SESSION_BACKEND backend, which forgets them
+    once they expire. The default in-process SessionStore can also be
+    capped at SESSION_MAX_SIZE entries (least recently used evicted
+    first) and is swept every SESSION_SWEEP_INTERVAL seconds.
+    """
     def __init__(self):
         """Init class"""
         try:
@@ -14,6 +21,22 @@ class SessionExpAuth(SessionAuth):
         except Exception:
             self.session_duration = 0
 
+        try:
+            max_size = int(os.getenv('SESSION_MAX_SIZE'))
+        except Exception:
+            max_size = 0
+
+        try:
+            sweep_interval = float(os.getenv('SESSION_SWEEP_INTERVAL'))
+        except Exception:
+            sweep_interval = 60
+
+        self.user_id_by_session_id = create_session_backend(
+            ttl=self.session_duration,
+            max_size=max_size,
+            sweep_interval=sweep_interval
+        )
+
     def create_session(self, user_id=None):
         """overload create_session function from SessiionAuth"""
         try:
@@ -37,10 +60,10 @@ class SessionExpAuth(SessionAuth):
         if session_id is None:
             return None
 
-        if session_id not in self.user_id_by_session_id.keys():
+        session_dict = self.user_id_by_session_id.get(session_id)
+        if session_dict is None:
             return None
 
-        session_dict = self.user_id_by_session_id.get(session_id)
         if self.session_duration <= 0:
             return session_dict.get('user_id')
 
@@ -54,3 +77,11 @@ class SessionExpAuth(SessionAuth):
             return None
 
         return session_dict.get('user_id')
+
+    def session_stats(self) -> dict:
+        """live, expired and evicted session counts of the memory backend,
+        only the live count for shared backends"""
+        stats = getattr(self.user_id_by_session_id, 'stats', None)
+        if stats is None:
+            return {"live": len(self.user_id_by_session_id)}
+        return stats()
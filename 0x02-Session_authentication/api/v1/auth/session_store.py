@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""In-memory session store with expiry, LRU bound and background sweeping"""
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Iterator
+import heapq
+import threading
+import time
+
+
+class SessionStore(MutableMapping):
+    """Dict-like map of session id -> session data
+
+    Entries older than ttl seconds are dropped: lazily when looked up
+    and eagerly by a daemon thread that pops a heap of deadlines every
+    sweep_interval seconds, so memory stays bounded under login churn.
+    With max_size > 0 the least recently used entry is evicted when the
+    store is full. ttl <= 0 means entries never expire.
+    """
+
+    def __init__(self, ttl: float = 0, max_size: int = 0,
+                 sweep_interval: float = 60):
+        """init the store and start the sweeper when entries can expire"""
+        self.ttl = ttl
+        self.max_size = max_size
+        self.expired = 0
+        self.evicted = 0
+        self._entries = OrderedDict()
+        self._deadlines = {}
+        self._heap = []
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+
+        if ttl > 0 and sweep_interval > 0:
+            sweeper = threading.Thread(target=self._sweep_loop,
+                                       args=(sweep_interval,), daemon=True)
+            sweeper.start()
+
+    def __setitem__(self, session_id: str, value):
+        """store value, resetting its expiry and LRU position"""
+        with self._lock:
+            self._entries[session_id] = value
+            self._entries.move_to_end(session_id)
+            if self.ttl > 0:
+                deadline = time.monotonic() + self.ttl
+                self._deadlines[session_id] = deadline
+                heapq.heappush(self._heap, (deadline, session_id))
+            if self.max_size > 0:
+                while len(self._entries) > self.max_size:
+                    oldest, _ = self._entries.popitem(last=False)
+                    self._deadlines.pop(oldest, None)
+                    self.evicted += 1
+            self._compact_heap()
+
+    def __getitem__(self, session_id: str):
+        """return a live entry and mark it recently used"""
+        with self._lock:
+            value = self._entries[session_id]
+            deadline = self._deadlines.get(session_id)
+            if deadline is not None and deadline <= time.monotonic():
+                self._drop(session_id)
+                self.expired += 1
+                raise KeyError(session_id)
+            self._entries.move_to_end(session_id)
+            return value
+
+    def __delitem__(self, session_id: str):
+        """remove an entry"""
+        with self._lock:
+            del self._entries[session_id]
+            self._deadlines.pop(session_id, None)
+            self._compact_heap()
+
+    def __iter__(self) -> Iterator[str]:
+        """iterate over a snapshot of the stored session ids"""
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        """number of stored entries, including expired ones not yet swept"""
+        return len(self._entries)
+
+    def sweep(self) -> int:
+        """drop every expired entry, return how many were dropped"""
+        dropped = 0
+        now = time.monotonic()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, session_id = heapq.heappop(self._heap)
+                # skip heap entries left behind by a re-set or a delete
+                if self._deadlines.get(session_id) == deadline:
+                    self._drop(session_id)
+                    dropped += 1
+            self.expired += dropped
+        return dropped
+
+    def stats(self) -> Dict[str, int]:
+        """live, expired and evicted entry counts"""
+        return {"live": len(self._entries), "expired": self.expired,
+                "evicted": self.evicted}
+
+    def close(self):
+        """stop the sweeper thread"""
+        self._stop.set()
+
+    def _drop(self, session_id: str):
+        """forget an entry; the caller holds the lock"""
+        self._entries.pop(session_id, None)
+        self._deadlines.pop(session_id, None)
+
+    def _compact_heap(self):
+        """rebuild the heap from the live deadlines once entries left
+        behind by re-sets, deletes and evictions make up most of it, so
+        it stays proportional to the store; the caller holds the lock"""
+        if len(self._heap) > 2 * len(self._entries):
+            self._heap = [(deadline, session_id) for session_id, deadline
+                          in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _sweep_loop(self, interval: float):
+        """body of the sweeper thread"""
+        while not self._stop.wait(interval):
+            self.sweep()
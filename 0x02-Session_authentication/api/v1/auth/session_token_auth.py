@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Stateless session authentication with signed, expiring cookies"""
+from api.v1.auth.session_auth import SessionAuth
+from api.v1.auth.session_backends import create_session_backend
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Dict
+from uuid import uuid4
+import hashlib
+import hmac
+import json
+import os
+import time
+
+
+def b64encode(data: bytes) -> str:
+    """unpadded urlsafe base64, safe to put in a cookie"""
+    return urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def b64decode(data: str) -> bytes:
+    """inverse of b64encode"""
+    return urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class SessionTokenAuth(SessionAuth):
+    """Session auth whose session id is a self-contained signed token
+
+    The cookie is <payload>.<key id>.<signature> where payload holds the
+    user_id, issued_at and a token id, and signature is an HMAC-SHA256
+    of payload and key id. Validating it is CPU work plus a lookup in
+    the revocations: no session is stored.
+
+    SESSION_TOKEN_KEYS lists "key_id:secret" pairs separated by commas;
+    the first signs new tokens and all of them verify, so keys can be
+    rotated by prepending a new one. Without it a random key is made,
+    valid for this process only. Tokens expire SESSION_DURATION seconds
+    after they are issued, or SESSION_TOKEN_TTL seconds (default 4
+    hours) when SESSION_DURATION is 0 or unset: a token that never
+    expires could never be forgotten by the revocations.
+
+    Logged out token ids are revoked in the SESSION_BACKEND backend,
+    with the token lifetime as the backend ttl, so a revocation outlives
+    its token and the revocations only ever hold the logouts of the
+    last lifetime. With a shared backend (sqlite, redis) a logout is
+    seen by every worker. SESSION_TOKEN_REVOCATION=0 turns revocation
+    off, and logouts are then refused since tokens stay valid.
+    """
+    REVOKED_PREFIX = "revoked:"
+    DEFAULT_TTL = 4 * 3600
+
+    def __init__(self):
+        """read the signing keys, lifetime and revocation settings"""
+        self.keys: Dict[str, bytes] = {}
+        for pair in os.getenv("SESSION_TOKEN_KEYS", "").split(","):
+            key_id, _, secret = pair.strip().partition(":")
+            if key_id and secret:
+                self.keys[key_id] = secret.encode()
+        if not self.keys:
+            self.keys["local"] = os.urandom(32)
+        self.signing_key_id = next(iter(self.keys))
+
+        try:
+            self.session_duration = int(os.getenv('SESSION_DURATION'))
+        except Exception:
+            self.session_duration = 0
+        if self.session_duration <= 0:
+            try:
+                self.session_duration = int(os.getenv('SESSION_TOKEN_TTL'))
+            except Exception:
+                self.session_duration = 0
+        if self.session_duration <= 0:
+            self.session_duration = self.DEFAULT_TTL
+
+        self.revoked = None
+        if os.getenv("SESSION_TOKEN_REVOCATION", "1") != "0":
+            self.revoked = create_session_backend(ttl=self.session_duration)
+
+    def create_session(self, user_id: str = None) -> str:
+        """issue a signed token for a user"""
+        if user_id is None:
+            return None
+
+        if not isinstance(user_id, str):
+            return None
+
+        payload = b64encode(json.dumps({
+            "user_id": user_id,
+            "issued_at": int(time.time()),
+            "jti": uuid4().hex
+        }, separators=(",", ":")).encode())
+
+        return "{}.{}.{}".format(
+            payload, self.signing_key_id,
+            self._sign(self.signing_key_id, payload)
+        )
+
+    def user_id_for_session_id(self, session_id: str = None) -> str:
+        """return the user id of a valid, unexpired, unrevoked token"""
+        claims = self._verify(session_id)
+        if claims is None:
+            return None
+
+        return claims.get("user_id")
+
+    def destroy_session(self, request=None):
+        """log out by revoking the token of the request; refused when
+        revocation is off, since the token would stay valid"""
+        if request is None:
+            return False
+
+        session_id = self.session_cookie(request)
+        claims = self._verify(session_id)
+        if claims is None or self.revoked is None:
+            return False
+
+        self.revoked[self.REVOKED_PREFIX + str(claims.get("jti"))] = \
+            claims.get("user_id")
+
+        self.forget_request_session(session_id)
+        return True
+
+    def _sign(self, key_id: str, payload: str) -> str:
+        """signature of payload with the key key_id"""
+        message = "{}.{}".format(payload, key_id).encode()
+        return b64encode(
+            hmac.new(self.keys[key_id], message, hashlib.sha256).digest()
+        )
+
+    def _verify(self, token: str) -> dict:
+        """claims of a valid token, None otherwise"""
+        if not isinstance(token, str):
+            return None
+
+        parts = token.split(".")
+        if len(parts) != 3:
+            return None
+
+        payload, key_id, signature = parts
+        if key_id not in self.keys:
+            return None
+
+        if not hmac.compare_digest(self._sign(key_id, payload).encode(),
+                                   signature.encode()):
+            return None
+
+        try:
+            claims = json.loads(b64decode(payload))
+            issued_at = int(claims["issued_at"])
+        except Exception:
+            return None
+
+        if issued_at + self.session_duration < time.time():
+            return None
+
+        if self.revoked is not None and \
+                self.REVOKED_PREFIX + str(claims.get("jti")) in self.revoked:
+            return None
+
+        return claims
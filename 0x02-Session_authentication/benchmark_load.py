@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+""" Benchmark of User.load_from_file() with lazy timestamps
+
+Writes --users users to .db_User.json in a temporary directory, then
+times the load as the original Base.__init__ did it (two strptime per
+object) and as it does now (timestamps kept raw, parsed on access),
+plus what touching every created_at costs afterwards.
+
+Usage: ./benchmark_load.py [--users N]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from models.base import DATA, TIMESTAMP_FORMAT
+from models.user import User
+
+
+def legacy_load():
+    """ The original load_from_file, parsing every timestamp eagerly
+    """
+    with open(".db_User.json", "r") as f:
+        objs_json = json.load(f)
+    DATA["User"] = {}
+    for obj_id, obj_json in objs_json.items():
+        user = User(**obj_json)
+        user.created_at = datetime.strptime(obj_json["created_at"],
+                                            TIMESTAMP_FORMAT)
+        user.updated_at = datetime.strptime(obj_json["updated_at"],
+                                            TIMESTAMP_FORMAT)
+        DATA["User"][obj_id] = user
+
+
+def timed(func) -> float:
+    """ Seconds taken by func()
+    """
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        with open(".db_User.json", "w") as f:
+            json.dump({str(i): {
+                "id": str(i),
+                "created_at": "2024-01-01T00:00:00",
+                "updated_at": "2024-01-02T12:30:00",
+                "email": "user{}@example.com".format(i),
+                "_password": "x" * 64,
+            } for i in range(args.users)}, f)
+
+        legacy = timed(legacy_load)
+        lazy = timed(User.load_from_file)
+        access = timed(lambda: [u.created_at for u in DATA["User"].values()])
+
+    print("{} users: strptime load {:.3f}s, lazy load {:.3f}s ({:.1f}x),"
+          " then parsing every created_at {:.3f}s".format(
+              args.users, legacy, lazy, legacy / lazy, access))
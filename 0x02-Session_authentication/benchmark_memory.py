@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+""" Benchmark of the memory held per loaded model object
+
+Loads --objects users and user sessions from .db_*.json files in a
+temporary directory, once with the default representation and once
+with MODELS_COMPACT=1, each in a child process, and reports the bytes
+traced by tracemalloc per object resident in DATA.
+
+Usage: ./benchmark_memory.py [--objects N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+
+CHILD = """
+import gc
+import tracemalloc
+from models.user import User
+from models.user_session import UserSession
+for cls in (User, UserSession):
+    gc.collect()
+    tracemalloc.start()
+    cls.load_from_file()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("{{:<8}} {{:<12}} {{:8.1f}} bytes/object".format(
+        "{mode}", cls.__name__, size / cls.count()))
+"""
+
+
+def write_files(objects: int):
+    """ Write objects users and as many sessions in the current directory
+    """
+    users = {}
+    sessions = {}
+    for i in range(objects):
+        user_id = str(uuid.uuid4())
+        users[user_id] = {
+            "id": user_id,
+            "created_at": "2024-01-01T00:00:00",
+            "updated_at": "2024-01-02T12:30:00",
+            "email": "user{}@example.com".format(i),
+            "_password": "x" * 64,
+            "first_name": None,
+            "last_name": None,
+        }
+        session_id = str(uuid.uuid4())
+        sessions[session_id] = {
+            "id": session_id,
+            "created_at": "2024-01-01T00:00:00",
+            "updated_at": "2024-01-01T00:00:00",
+            "user_id": user_id,
+            "session_id": str(uuid.uuid4()),
+        }
+    with open(".db_User.json", "w") as f:
+        json.dump(users, f)
+    with open(".db_UserSession.json", "w") as f:
+        json.dump(sessions, f)
+
+
+def run(mode: str, compact: str):
+    """ Measure the loaded objects with MODELS_COMPACT=compact
+    """
+    env = dict(os.environ, MODELS_COMPACT=compact,
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", CHILD.format(mode=mode)],
+                   env=env, check=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--objects", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        write_files(args.objects)
+        run("default", "0")
+        run("compact", "1")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+""" Benchmark of the per-request session lookup done by SessionDBAuth
+
+For each session count a .db_UserSession.json is generated in a
+temporary directory, then one lookup is timed the old way (reload the
+whole file, then search) and the new way (reload_if_changed, then an
+indexed search).
+
+Usage: ./benchmark_sessions.py [--sessions 10000 100000 1000000]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+
+from models.user_session import UserSession
+
+
+def write_sessions(count: int) -> str:
+    """ Write count sessions to .db_UserSession.json, return one id
+    """
+    objs_json = {}
+    for _ in range(count):
+        obj_id = str(uuid.uuid4())
+        objs_json[obj_id] = {
+            "id": obj_id,
+            "created_at": "2024-01-01T00:00:00",
+            "updated_at": "2024-01-01T00:00:00",
+            "user_id": str(uuid.uuid4()),
+            "session_id": str(uuid.uuid4()),
+        }
+    with open(".db_UserSession.json", "w") as f:
+        json.dump(objs_json, f)
+    return objs_json[obj_id]["session_id"]
+
+
+def per_lookup(lookup, session_id: str, repeat: int) -> float:
+    """ Average seconds of repeat lookups of session_id
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        assert lookup(session_id)
+    return (time.perf_counter() - start) / repeat
+
+
+def old_lookup(session_id: str) -> list:
+    """ What SessionDBAuth did before: reload everything, scan
+    """
+    UserSession.load_from_file()
+    return [s for s in UserSession.all() if s.session_id == session_id]
+
+
+def new_lookup(session_id: str) -> list:
+    """ What SessionDBAuth does now
+    """
+    UserSession.reload_if_changed()
+    return UserSession.search({"session_id": session_id})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, nargs="+",
+                        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--old-repeat", type=int, default=3)
+    parser.add_argument("--new-repeat", type=int, default=10_000)
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        for count in args.sessions:
+            session_id = write_sessions(count)
+            old = per_lookup(old_lookup, session_id, args.old_repeat)
+            new_lookup(session_id)
+            new = per_lookup(new_lookup, session_id, args.new_repeat)
+            print("{:>9} sessions  old {:10.1f}us  new {:8.2f}us".format(
+                count, old * 1e6, new * 1e6))
+        os.chdir(cwd)
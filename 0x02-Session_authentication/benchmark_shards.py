@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+""" Benchmark of cold-start User.load_from_file() against loader processes
+
+Writes --users users once as a single .db_User.json and once split into
+--shards shard files, in a temporary directory, then times the load in
+a fresh child process: unsharded, then sharded with 1, 2, 4... loader
+processes up to the number of cores. Shards are parsed in parallel but
+objects are built in the main process, so the gain is bounded by the
+parsing share of the load.
+
+Usage: ./benchmark_shards.py [--users N] [--shards N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SETUP = """
+import json
+from models.storage import get_storage
+with open("users.json") as f:
+    get_storage().dump("User", json.load(f))
+"""
+
+CHILD = """
+import sys
+import time
+from models.user import User
+start = time.perf_counter()
+User.load_from_file(progress=lambda done, total, count: print(
+    "\\r  {{}}/{{}} shards, {{}} users".format(done, total, count),
+    end="", file=sys.stderr))
+elapsed = time.perf_counter() - start
+print("\\r{{:<24}} {{:8.3f}}s for {{}} users".format(
+    "{label}", elapsed, User.count()))
+"""
+
+
+def run(label: str, code: str, **env: dict):
+    """ Run code in a child process with extra environment variables
+    """
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.abspath(__file__)), **env)
+    subprocess.run([sys.executable, "-c", code.format(label=label)],
+                   env=env, check=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500_000)
+    parser.add_argument("--shards", type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        with open("users.json", "w") as f:
+            json.dump({"{:032x}".format(i): {
+                "id": "{:032x}".format(i),
+                "created_at": "2024-01-01T00:00:00",
+                "updated_at": "2024-01-01T00:00:00",
+                "email": "user{}@example.com".format(i),
+                "_password": "x" * 64,
+            } for i in range(args.users)}, f)
+
+        run("", SETUP, MODELS_STORAGE="file")
+        run("unsharded", CHILD, MODELS_STORAGE="file")
+        run("", SETUP, MODELS_STORAGE="sharded",
+            MODELS_SHARDS=str(args.shards))
+        workers = 1
+        while True:
+            run("{} shards, {} workers".format(args.shards, workers), CHILD,
+                MODELS_STORAGE="sharded", MODELS_SHARDS=str(args.shards),
+                MODELS_LOAD_WORKERS=str(workers))
+            if workers >= (os.cpu_count() or 1):
+                break
+            workers = min(workers * 2, os.cpu_count())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+""" Benchmark of worker startup with each storage engine
+
+Stores --users users with every engine in a temporary directory, then
+times, in a fresh child process per engine, User.load_from_file()
+followed by one User.get and one indexed User.search: what a worker
+does before serving its first request.
+
+Usage: ./benchmark_startup.py [--users N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SETUP = """
+import json
+from models.storage import get_storage
+from models.user import User
+User.load_from_file()
+with open("users.json") as f:
+    get_storage().dump("User", json.load(f))
+get_storage().flush()
+"""
+
+CHILD = """
+import time
+start = time.perf_counter()
+from models.user import User
+User.load_from_file()
+loaded = time.perf_counter() - start
+User.get("{user_id}")
+User.search({{"email": "user1@example.com"}})
+first = time.perf_counter() - start
+print("{{:<8}} load {{:8.3f}}s, first request served after {{:8.3f}}s"
+      .format("{engine}", loaded, first))
+"""
+
+
+def run(engine: str, code: str):
+    """ Run code in a child process using the storage engine engine
+    """
+    env = dict(os.environ, MODELS_STORAGE=engine,
+               MODELS_JOURNAL_COMPACT_INTERVAL="0",
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        users = {}
+        for i in range(args.users):
+            user_id = "{:032x}".format(i)
+            users[user_id] = {
+                "id": user_id,
+                "created_at": "2024-01-01T00:00:00",
+                "updated_at": "2024-01-01T00:00:00",
+                "email": "user{}@example.com".format(i),
+                "_password": "x" * 64,
+            }
+        with open("users.json", "w") as f:
+            json.dump(users, f)
+        user_id = "{:032x}".format(args.users // 2)
+        for engine in ("journal", "binary", "sqlite"):
+            run(engine, SETUP)
+            run(engine, CHILD.format(engine=engine, user_id=user_id))
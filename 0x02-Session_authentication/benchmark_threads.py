@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+""" Multi-threaded stress benchmark of the DATA registry
+
+Starts from --users users and runs --ops operations spread over 1 to 32
+threads: mostly User.get and indexed User.search, with --write-ratio of
+them removing or recreating a user, while one more thread keeps
+calling save_to_file().
+Prints the throughput and the number of exceptions raised (expected 0)
+for each thread count. It runs in a temporary directory with the
+journal storage engine, so the real .db_*.json files are left alone.
+
+Usage: ./benchmark_threads.py [--users N] [--ops N] [--write-ratio F]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("MODELS_STORAGE", "journal")
+os.environ.setdefault("MODELS_JOURNAL_COMPACT_INTERVAL", "0")
+
+from models.user import User  # noqa: E402
+
+
+def worker(ids: list, ops: int, write_ratio: float, errors: list):
+    """ Run ops random reads and writes on the users of ids
+    """
+    rng = random.Random()
+    try:
+        for _ in range(ops):
+            n = rng.randrange(len(ids))
+            if rng.random() < write_ratio:
+                user = User.get(ids[n])
+                if user is None:
+                    user = User(id=ids[n])
+                    user.email = "user{}@example.com".format(n)
+                    user.save()
+                else:
+                    user.remove()
+            elif n % 2:
+                User.get(ids[n])
+            else:
+                User.search({"email": "user{}@example.com".format(n)})
+    except Exception as e:
+        errors.append(e)
+
+
+def flusher(stop: threading.Event, errors: list):
+    """ Snapshot the whole class until stop is set
+    """
+    try:
+        while not stop.is_set():
+            User.save_to_file()
+    except Exception as e:
+        errors.append(e)
+
+
+def run(ids: list, threads: int, ops: int, write_ratio: float) -> tuple:
+    """ Throughput and exceptions with threads worker threads
+    """
+    errors = []
+    stop = threading.Event()
+    background = threading.Thread(target=flusher, args=(stop, errors))
+    workers = [threading.Thread(target=worker,
+                                args=(ids, ops // threads, write_ratio,
+                                      errors))
+               for _ in range(threads)]
+    background.start()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    background.join()
+    return ops / elapsed, len(errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--ops", type=int, default=100_000)
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        User.load_from_file()
+        ids = []
+        for i in range(args.users):
+            user = User(email="user{}@example.com".format(i))
+            user.save()
+            ids.append(user.id)
+        for threads in (1, 2, 4, 8, 16, 32):
+            throughput, errors = run(ids, threads, args.ops,
+                                     args.write_ratio)
+            print("{:>2} threads: {:10.0f} ops/s, {} exceptions".format(
+                threads, throughput, errors))
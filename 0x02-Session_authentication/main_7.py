@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+""" Main 7
+"""
+import os
+import time
+from api.v1.auth.session_backends import create_session_backend
+from resp_server import serve_in_thread
+
+""" Run RedisSessionBackend against the local RESP stand-in """
+server = serve_in_thread()
+os.environ["SESSION_BACKEND"] = "redis"
+os.environ["SESSION_REDIS_URL"] = "redis://{}:{}/1".format(
+    *server.server_address)
+
+sessions = create_session_backend(ttl=0.5)
+print(type(sessions).__name__)
+
+sessions["abc"] = "user-1"
+sessions["def"] = {"user_id": "user-2", "created_at": None}
+print(sessions["abc"])
+print(sorted(sessions), len(sessions))
+
+del sessions["abc"]
+print("abc" in sessions)
+try:
+    del sessions["abc"]
+except KeyError:
+    print("KeyError on a missing session")
+
+""" Sessions live in the selected database only """
+print(sorted(server.dbs), list(server.dbs[1]))
+
+""" An idle connection the server closed is replaced """
+server.drop_connections()
+time.sleep(0.1)
+print(sessions["def"])
+
+""" A DEL whose reply is lost is not sent again """
+sessions["ghi"] = "user-3"
+server.drop_next_reply = True
+try:
+    del sessions["ghi"]
+except KeyError:
+    print("KeyError: DEL was retried")
+except ConnectionError:
+    print("ConnectionError, ghi deleted: {}".format("ghi" not in sessions))
+
+""" The server expires sessions """
+time.sleep(0.6)
+print("def" in sessions, len(sessions))
+server.shutdown()
@@ -1,37 +1,264 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
-import json
+from datetime import datetime, timedelta
+from os import getenv
+from typing import Callable, TypeVar, List, Iterable, Tuple
+from models.query import Query, SortedIndex
+from models.storage import get_storage
+from weakref import WeakValueDictionary
+import threading
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEXES = {}
+STAMPS = {}
+LOCKS = {}
+COMPACT = getenv("MODELS_COMPACT", "").lower() in ("1", "true", "yes")
+COMPACT_FIELDS = {}
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string
+
+    datetime.fromisoformat reads this fixed layout much faster than
+    strptime; anything else still goes through strptime so that it
+    accepts and rejects exactly what TIMESTAMP_FORMAT does. Checking
+    every separator matters: fromisoformat also reads 19 characters
+    such as '2024-01-01T00:00+01' (with a timezone) or '2024-W01-1T...'
+    """
+    if len(value) == 19 and value[4] == value[7] == '-' and \
+            value[10] == 'T' and value[13] == value[16] == ':':
+        return datetime.fromisoformat(value)
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+class RawTimestamp():
+    """ A timestamp as read from storage, parsed on first use
+    """
+    __slots__ = ('raw', 'parsed')
+
+    def __init__(self, raw: str):
+        """ Keep the raw string, nothing is parsed yet
+        """
+        self.raw = raw
+        self.parsed = None
+
+    def value(self) -> datetime:
+        """ The parsed datetime, computed once
+        """
+        if self.parsed is None:
+            self.parsed = parse_timestamp(self.raw)
+        return self.parsed
+
+
+class Timestamp():
+    """ Data descriptor of a datetime attribute loaded lazily
+
+    Values read from storage are stored as a RawTimestamp and parsed on
+    first access; to_json writes their raw string back as long as the
+    attribute was not reassigned.
+    """
+
+    def __set_name__(self, owner: type, name: str):
+        """ Remember the attribute name
+        """
+        self.name = name
+
+    def __get__(self, obj: TypeVar('Base'), objtype: type = None):
+        """ The attribute as a datetime
+        """
+        if obj is None:
+            return self
+        try:
+            value = obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+        if type(value) is RawTimestamp:
+            return value.value()
+        return value
+
+    def __set__(self, obj: TypeVar('Base'), value):
+        """ Set the attribute, a str is taken as TIMESTAMP_FORMAT
+        """
+        if type(value) is str:
+            value = RawTimestamp(value)
+        obj.__dict__[self.name] = value
+
+
+class CompactId():
+    """ Descriptor of Base.id in compact mode
+
+    A canonical uuid string is kept in the slot as its 16 raw bytes and
+    rebuilt on access; any other id is kept as given.
+    """
+
+    def __init__(self, slot: str):
+        """ Store the value in slot
+        """
+        self.slot = slot
+
+    def __get__(self, obj: TypeVar('Base'), objtype: type = None):
+        """ The id as a string
+        """
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if type(value) is bytes:
+            return str(uuid.UUID(bytes=value))
+        return value
+
+    def __set__(self, obj: TypeVar('Base'), value):
+        """ Pack value if it is a canonical uuid string
+        """
+        if type(value) is str and len(value) == 36:
+            try:
+                packed = uuid.UUID(value)
+            except ValueError:
+                packed = None
+            if packed is not None and str(packed) == value:
+                value = packed.bytes
+        setattr(obj, self.slot, value)
+
+
+class EpochTimestamp():
+    """ Descriptor of a datetime attribute in compact mode
+
+    The slot holds whole seconds since EPOCH as an int, which is all
+    TIMESTAMP_FORMAT keeps anyway.
+    """
+
+    def __init__(self, slot: str):
+        """ Store the value in slot
+        """
+        self.slot = slot
+
+    def __get__(self, obj: TypeVar('Base'), objtype: type = None):
+        """ The attribute as a datetime
+        """
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if type(value) is int:
+            return EPOCH + timedelta(seconds=value)
+        return value
+
+    def __set__(self, obj: TypeVar('Base'), value):
+        """ Set the attribute, a str is taken as TIMESTAMP_FORMAT
+        """
+        if type(value) is str:
+            value = parse_timestamp(value)
+        if type(value) is datetime:
+            value = (value - EPOCH) // timedelta(seconds=1)
+        setattr(obj, self.slot, value)
+
+
+def model_slots(*attributes: str) -> Tuple[str, ...]:
+    """ __slots__ of a Base subclass whose instances hold attributes
+
+    In compact mode (MODELS_COMPACT=1) instances get these slots and no
+    __dict__; otherwise the empty tuple keeps the inherited __dict__.
+    """
+    if COMPACT:
+        return attributes
+    return ()
+
+
+class HashIndex():
+    """ Hash index on one attribute: value -> {id: object}
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index
+        """
+        self.attribute = attribute
+        self.by_value = {}
+        self.value_by_id = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index obj under its current attribute value
+        """
+        self.discard(obj.id)
+        value = getattr(obj, self.attribute, None)
+        try:
+            self.by_value.setdefault(value, {})[obj.id] = obj
+        except TypeError:
+            return
+        self.value_by_id[obj.id] = value
+
+    def discard(self, obj_id: str):
+        """ Drop obj_id from the index if present
+        """
+        if obj_id not in self.value_by_id:
+            return
+        value = self.value_by_id.pop(obj_id)
+        bucket = self.by_value[value]
+        del bucket[obj_id]
+        if not bucket:
+            del self.by_value[value]
+
+    def lookup(self, value) -> List[TypeVar('Base')]:
+        """ Objects whose indexed value was value when last saved
+        """
+        return list(self.by_value.get(value, {}).values())
 
 
 class Base():
     """ Base class
+
+    Subclasses list the attributes they are searched by most in
+    INDEXED_ATTRIBUTES; search() then answers equality queries on them
+    from a hash index instead of scanning every object. query() gives
+    range conditions, ordering and limits, served from sorted indexes
+    for the attributes in SORTED_ATTRIBUTES.
+
+    Writers of a class (save, remove, loads, index builds) are serialised
+    by its lock(). Readers take no lock: they work on a copy of the
+    DATA[class] dict or of an index bucket, made atomically, so a flush
+    or a search never sees a dict changing size under it. Loads build a
+    new dict and swap it in whole.
+
+    With MODELS_COMPACT=1 instances have __slots__ instead of a __dict__
+    (subclasses declare theirs with model_slots()), the id is packed in
+    16 bytes and timestamps are int seconds since EPOCH.
+
+    With a lazy storage engine (MODELS_STORAGE=sqlite) nothing is loaded
+    up front: get, search, query and count read the storage, and
+    DATA[class] is a weak identity map of the objects currently in use,
+    so the same object is returned while it is referenced. Conditions
+    are then checked against the last saved values.
     """
+    INDEXED_ATTRIBUTES: Tuple[str, ...] = ()
+    SORTED_ATTRIBUTES: Tuple[str, ...] = ('created_at', 'updated_at')
+    if COMPACT:
+        __slots__ = ('_id', '_created_at', '_updated_at', '__weakref__')
+        id = CompactId('_id')
+        created_at = EpochTimestamp('_created_at')
+        updated_at = EpochTimestamp('_updated_at')
+    else:
+        created_at = Timestamp()
+        updated_at = Timestamp()
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+            self.__class__._data()
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        if 'id' in kwargs:
+            self.id = kwargs['id']
+        else:
+            self.id = str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = kwargs.get('created_at')
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = kwargs.get('updated_at')
         else:
             self.updated_at = datetime.utcnow()
 
@@ -48,64 +275,298 @@ class Base():
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        if COMPACT:
+            items = self._compact_items()
+        else:
+            items = self.__dict__.items()
+        for key, value in items:
             if not for_serialization and key[0] == '_':
                 continue
-            if type(value) is datetime:
+            if type(value) is RawTimestamp:
+                result[key] = value.raw
+            elif type(value) is datetime:
                 result[key] = value.strftime(TIMESTAMP_FORMAT)
             else:
                 result[key] = value
         return result
 
+    def _compact_items(self) -> Iterable[Tuple[str, object]]:
+        """ (name, value) of every attribute set, in compact mode
+        """
+        s_class = self.__class__.__name__
+        fields = COMPACT_FIELDS.get(s_class)
+        if fields is None:
+            fields = ['id', 'created_at', 'updated_at']
+            for klass in reversed(self.__class__.__mro__):
+                if klass is not Base and issubclass(klass, Base):
+                    fields.extend(klass.__dict__.get('__slots__', ()))
+            COMPACT_FIELDS[s_class] = fields
+        for field in fields:
+            try:
+                yield field, getattr(self, field)
+            except AttributeError:
+                continue
+
+    @classmethod
+    def lock(cls) -> threading.RLock:
+        """ The lock serialising the writers of this class
+        """
+        s_class = cls.__name__
+        lock = LOCKS.get(s_class)
+        if lock is None:
+            lock = LOCKS.setdefault(s_class, threading.RLock())
+        return lock
+
     @classmethod
-    def load_from_file(cls):
+    def _data(cls) -> dict:
+        """ DATA[class], created on first use
+        """
+        s_class = cls.__name__
+        data = DATA.get(s_class)
+        if data is None:
+            storage = get_storage()
+            if storage.lazy:
+                storage.ensure_indexes(
+                    s_class, cls.INDEXED_ATTRIBUTES + cls.SORTED_ATTRIBUTES)
+                data = WeakValueDictionary()
+            else:
+                data = {}
+            data = DATA.setdefault(s_class, data)
+        return data
+
+    @staticmethod
+    def json_value(value):
+        """ value as to_json writes it
+        """
+        if type(value) is datetime:
+            return value.strftime(TIMESTAMP_FORMAT)
+        return value
+
+    @classmethod
+    def attribute_value(cls, attribute: str, value):
+        """ value as the attribute holds it: a str compared with a
+        timestamp attribute is parsed as TIMESTAMP_FORMAT if it can be
+        """
+        if type(value) is str and isinstance(
+                getattr(cls, attribute, None), (Timestamp, EpochTimestamp)):
+            try:
+                return parse_timestamp(value)
+            except ValueError:
+                pass
+        return value
+
+    @classmethod
+    def materialize(cls, obj_json: dict) -> TypeVar('Base'):
+        """ The object of a JSON read from a lazy storage, None for None
+
+        An object of this id still in use is returned instead of a copy.
+        """
+        if obj_json is None:
+            return None
+        data = cls._data()
+        obj = data.get(obj_json['id'])
+        if obj is None:
+            obj = data.setdefault(obj_json['id'], cls(**obj_json))
+        return obj
+
+    @classmethod
+    def load_from_file(cls, progress: Callable[[int, int, int], None] = None):
         """ Load all objects from file
+
+        Objects are built shard by shard as the storage reads them, and
+        progress, if given, is called after each shard with the number
+        of shards done, the number of shards and the objects loaded.
+        A lazy storage loads nothing: the identity map is only emptied,
+        so that the next reads see the stored state.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        with cls.lock():
+            storage = get_storage()
+            stamp = storage.stamp(s_class)
+            if storage.lazy:
+                DATA.pop(s_class, None)
+                cls._data()
+                INDEXES.pop(s_class, None)
+                STAMPS[s_class] = stamp
+                return
+            objs = {}
+            for done, total, objs_json in storage.load_shards(s_class):
+                for obj_id, obj_json in objs_json.items():
+                    objs[obj_id] = cls(**obj_json)
+                if progress is not None:
+                    progress(done, total, len(objs))
+            DATA[s_class] = objs
+            INDEXES.pop(s_class, None)
+            STAMPS[s_class] = stamp
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def reload_if_changed(cls):
+        """ Bring the objects in memory up to date with the storage
+
+        Nothing is read when the files are unchanged since the last load,
+        only the new lines are applied when the journal merely grew, and
+        the class is fully reloaded otherwise.
+        """
+        s_class = cls.__name__
+        with cls.lock():
+            if s_class not in STAMPS:
+                cls.load_from_file()
+                return
+            stamp, entries = get_storage().changes(s_class,
+                                                   STAMPS[s_class])
+            if entries is None:
+                cls.load_from_file()
+                return
+            indexes = INDEXES.get(s_class, {}).values()
+            for entry in entries:
+                obj_id = entry["id"]
+                if entry["op"] == "upsert":
+                    obj = cls(**entry["obj"])
+                    DATA[s_class][obj_id] = obj
+                    for index in indexes:
+                        index.add(obj)
+                else:
+                    DATA[s_class].pop(obj_id, None)
+                    for index in indexes:
+                        index.discard(obj_id)
+            STAMPS[s_class] = stamp
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
+
+        With a lazy storage, only the objects in use are written back.
+        """
+        storage = get_storage()
+        if not storage.lazy:
+            written = storage.dump(cls.__name__, cls._snapshot())
+            with cls.lock():
+                cls._written(written)
+            return
+        for obj_id, obj_json in cls._snapshot().items():
+            written = storage.upsert(cls.__name__, obj_id, obj_json)
+            with cls.lock():
+                cls._written(written)
+
+    @classmethod
+    def flush(cls):
+        """ Write changes of this class still buffered by the storage
+        """
+        get_storage().flush(cls.__name__)
+
+    @classmethod
+    def _snapshot(cls) -> dict:
+        """ JSON dictionaries of all objects, keyed by id
+
+        Taken from a copy of DATA[class], so writers may go on meanwhile.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
         objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
+        for obj_id, obj in DATA[s_class].copy().items():
             objs_json[obj_id] = obj.to_json(True)
+        return objs_json
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _written(cls, written: Tuple[tuple, tuple]):
+        """ Record the stamp after a write of this process
+
+        written is the (before, after) stamp pair returned by the storage.
+        If the class was up to date with the storage before the write,
+        it still is after it, so reload_if_changed has nothing to read.
+        Called with the class lock held.
+        """
+        s_class = cls.__name__
+        if written is not None and STAMPS.get(s_class) == written[0]:
+            STAMPS[s_class] = written[1]
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with self.__class__.lock():
+            self.updated_at = datetime.utcnow()
+            DATA[s_class][self.id] = self
+            for index in INDEXES.get(s_class, {}).values():
+                index.add(self)
+            self.__class__._written(get_storage().upsert(
+                s_class, self.id, self.to_json(True),
+                self.__class__._snapshot))
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        with self.__class__.lock():
+            storage = get_storage()
+            if DATA[s_class].get(self.id) is None and not storage.lazy:
+                return
+            DATA[s_class].pop(self.id, None)
+            for index in INDEXES.get(s_class, {}).values():
+                index.discard(self.id)
+            self.__class__._written(storage.delete(
+                s_class, self.id, self.__class__._snapshot))
+
+    @classmethod
+    def index(cls, attribute: str) -> HashIndex:
+        """ Return the index on attribute, building it on first use
+        """
+        s_class = cls.__name__
+        index = INDEXES.get(s_class, {}).get(attribute)
+        if index is not None:
+            return index
+        with cls.lock():
+            indexes = INDEXES.setdefault(s_class, {})
+            index = indexes.get(attribute)
+            if index is None:
+                index = HashIndex(attribute)
+                for obj in DATA[s_class].values():
+                    index.add(obj)
+                indexes[attribute] = index
+            return index
+
+    @classmethod
+    def sorted_index(cls, attribute: str) -> SortedIndex:
+        """ Return the sorted index on attribute, building it on first use
+
+        It lives in INDEXES next to the hash indexes, under the key
+        (attribute, 'sorted'), so saves and removals maintain it too.
+        """
+        s_class = cls.__name__
+        key = (attribute, 'sorted')
+        index = INDEXES.get(s_class, {}).get(key)
+        if index is not None:
+            return index
+        with cls.lock():
+            indexes = INDEXES.setdefault(s_class, {})
+            index = indexes.get(key)
+            if index is None:
+                index = SortedIndex(attribute)
+                for obj in DATA[s_class].values():
+                    index.add(obj)
+                indexes[key] = index
+            return index
+
+    @classmethod
+    def query(cls) -> Query:
+        """ Return a Query over all objects, see models.query
+        """
+        return Query(cls)
+
+    @classmethod
+    def objects(cls) -> List[TypeVar('Base')]:
+        """ All objects, from a copy of DATA[class]
+        """
+        s_class = cls.__name__
+        return list(DATA[s_class].copy().values())
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
         s_class = cls.__name__
+        storage = get_storage()
+        if storage.lazy:
+            return storage.count(s_class)
         return len(DATA[s_class].keys())
 
     @classmethod
@@ -119,19 +580,24 @@ class Base():
         """ Return one object by ID
         """
         s_class = cls.__name__
+        storage = get_storage()
+        if storage.lazy:
+            obj = cls._data().get(id)
+            if obj is not None:
+                return obj
+            return cls.materialize(storage.get(s_class, id))
         return DATA[s_class].get(id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        When an attribute is in INDEXED_ATTRIBUTES the candidates come
+        from its index (as of each object's last save) and only they are
+        checked against the other attributes. Equivalent to
+        query().filter(**attributes).all().
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        query = cls.query()
+        for k, v in attributes.items():
+            query = query.where(k, 'eq', v)
+        return query.all()
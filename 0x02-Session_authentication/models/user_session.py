@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 """Class that saves the session id and user_id to database"""
-from models.base import Base
+from models.base import Base, model_slots
 
 
 class UserSession(Base):
     """
     Class that inherits from base and saves to file database
     """
+    __slots__ = model_slots('user_id', 'session_id')
+    INDEXED_ATTRIBUTES = ('session_id', 'user_id')
+
     def __init__(self, *args: list, **kwargs: dict):
         """initalize class with user_id and session_id variables"""
         super().__init__(*args, **kwargs)
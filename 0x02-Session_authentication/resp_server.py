@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+""" Minimal in-memory server speaking the Redis protocol (RESP)
+
+A local stand-in for RedisSessionBackend when no Redis server is around.
+It knows the commands the backend sends: SET (with PX or EX), GET, DEL,
+SCAN (with MATCH and COUNT) and SELECT, plus PING. Expired keys are
+skipped by SCAN and dropped when read.
+
+Usage: ./resp_server.py [--host 127.0.0.1] [--port 6379]
+"""
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    """ One client connection: read commands, write replies
+    """
+
+    def setup(self):
+        """ Register the connection so the server can drop it
+        """
+        super().setup()
+        self.db = 0
+        self.server.track(self.request, True)
+
+    def finish(self):
+        """ Unregister the connection
+        """
+        self.server.track(self.request, False)
+        super().finish()
+
+    def handle(self):
+        """ Serve commands until the client goes away
+        """
+        while True:
+            try:
+                args = self.read_command()
+            except (OSError, ValueError):
+                return
+            if args is None:
+                return
+            reply = self.server.execute(self, args)
+            if self.server.take_drop_reply():
+                return
+            try:
+                self.wfile.write(reply)
+            except OSError:
+                return
+
+    def read_command(self) -> Optional[List[bytes]]:
+        """ Read one array of bulk strings, None at end of stream
+        """
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if line[:1] != b"*":
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = self.rfile.readline()
+            if header[:1] != b"$":
+                raise ValueError("expected a bulk string")
+            args.append(self.rfile.read(int(header[1:-2]) + 2)[:-2])
+        return args
+
+
+class RESPServer(socketserver.ThreadingTCPServer):
+    """ Threaded server holding every database in memory
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int]):
+        """ Bind to address with empty databases
+        """
+        super().__init__(address, RESPHandler)
+        self.dbs: Dict[int, Dict[bytes, Tuple[bytes, Optional[float]]]] = {}
+        self.drop_next_reply = False
+        self._clients = set()
+        self._lock = threading.Lock()
+
+    def track(self, sock, connected: bool):
+        """ Add or remove a client socket
+        """
+        with self._lock:
+            if connected:
+                self._clients.add(sock)
+            else:
+                self._clients.discard(sock)
+
+    def drop_connections(self):
+        """ Close every client connection, as a restarting server would
+        """
+        with self._lock:
+            clients = list(self._clients)
+        for sock in clients:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+
+    def take_drop_reply(self) -> bool:
+        """ Whether to close the connection instead of replying, once
+        """
+        with self._lock:
+            drop, self.drop_next_reply = self.drop_next_reply, False
+            return drop
+
+    def execute(self, handler: RESPHandler, args: List[bytes]) -> bytes:
+        """ Run one command, return its encoded reply
+        """
+        if not args:
+            return error("empty command")
+        name = args[0].decode().upper()
+        command = getattr(self, "cmd_" + name.lower(), None)
+        if command is None:
+            return error("unknown command '{}'".format(name))
+        with self._lock:
+            try:
+                return command(handler, args[1:])
+            except (IndexError, ValueError):
+                return error("syntax error")
+
+    def cmd_ping(self, handler: RESPHandler, args: List[bytes]) -> bytes:
+        """ PING
+        """
+        return b"+PONG\r\n"
+
+    def cmd_select(self, handler: RESPHandler, args: List[bytes]) -> bytes:
+        """ SELECT db
+        """
+        handler.db = int(args[0])
+        return b"+OK\r\n"
+
+    def cmd_set(self, handler: RESPHandler, args: List[bytes]) -> bytes:
+        """ SET key value [PX milliseconds | EX seconds]
+        """
+        key, value, options = args[0], args[1], args[2:]
+        expires_at = None
+        if options:
+            unit = options[0].upper()
+            if unit == b"PX":
+                expires_at = time.monotonic() + int(options[1]) / 1000
+            elif unit == b"EX":
+                expires_at = time.monotonic() + int(options[1])
+            else:
+                raise ValueError(unit)
+        self.db(handler)[key] = (value, expires_at)
+        return b"+OK\r\n"
+
+    def cmd_get(self, handler: RESPHandler, args: List[bytes]) -> bytes:
+        """ GET key
+        """
+        value = self.live(handler, args[0])
+        if value is None:
+            return b"$-1\r\n"
+        return bulk(value)
+
+    def cmd_del(self, handler: RESPHandler, args: List[bytes]) -> bytes:
+        """ DEL key [key ...]
+        """
+        deleted = 0
+        for key in args:
+            if self.live(handler, key) is not None:
+                del self.db(handler)[key]
+                deleted += 1
+        return b":%d\r\n" % deleted
+
+    def cmd_scan(self, handler: RESPHandler, args: List[bytes]) -> bytes:
+        """ SCAN cursor [MATCH pattern] [COUNT count]
+
+        The cursor is a position in the sorted keys, so keys that exist
+        for the whole scan are returned exactly once.
+        """
+        cursor, pattern, count = int(args[0]), "*", 10
+        options = args[1:]
+        while options:
+            option = options[0].upper()
+            if option == b"MATCH":
+                pattern = options[1].decode()
+            elif option == b"COUNT":
+                count = int(options[1])
+            else:
+                raise ValueError(option)
+            options = options[2:]
+        keys = sorted(self.db(handler))[cursor:cursor + count]
+        cursor = cursor + len(keys)
+        if len(keys) < count:
+            cursor = 0
+        db = self.db(handler)
+        matched = [key for key in keys
+                   if not expired(db[key])
+                   and fnmatch.fnmatchcase(key.decode(), pattern)]
+        return b"*2\r\n" + bulk(str(cursor).encode()) + \
+            b"*%d\r\n" % len(matched) + b"".join(map(bulk, matched))
+
+    def db(self, handler: RESPHandler) -> Dict:
+        """ The database selected by the connection
+        """
+        return self.dbs.setdefault(handler.db, {})
+
+    def live(self, handler: RESPHandler, key: bytes) -> Optional[bytes]:
+        """ Value of key, None when missing or expired
+        """
+        db = self.db(handler)
+        entry = db.get(key)
+        if entry is None:
+            return None
+        if expired(entry):
+            del db[key]
+            return None
+        return entry[0]
+
+
+def expired(entry: Tuple[bytes, Optional[float]]) -> bool:
+    """ Whether a (value, expires_at) entry has expired
+    """
+    return entry[1] is not None and entry[1] <= time.monotonic()
+
+
+def bulk(value: bytes) -> bytes:
+    """ Encode a bulk string reply
+    """
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def error(message: str) -> bytes:
+    """ Encode an error reply
+    """
+    return "-ERR {}\r\n".format(message).encode()
+
+
+def serve_in_thread(host: str = "127.0.0.1", port: int = 0) -> RESPServer:
+    """ Start a server in a daemon thread, port 0 picks a free port
+    """
+    server = RESPServer((host, port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+
+    with RESPServer((args.host, args.port)) as server:
+        print("Listening on {}:{}".format(*server.server_address))
+        server.serve_forever()